@@ -0,0 +1,95 @@
+import os
+import random
+
+LINE = "key%d = Hello, World! value number %d\n"
+
+
+def generate_tree(root, files, size, depth=2, fan_out=8, seed=0):
+    """
+    Creates a tree of text files.
+
+    :param root:        directory to create the files in.
+    :param files:       amount of files.
+    :param size:        approximated size of each file, in bytes.
+    :param depth:       levels of directories the files are spread over.
+    :param fan_out:     directories per level.
+    :param seed:        seed of the directory each file goes to.
+    :return:            the absolute paths of the files, sorted.
+    """
+    generator = random.Random(seed)
+    paths = []
+
+    line_size = len(LINE % (0, 0))
+    lines = max(1, size // line_size)
+    content = "".join(LINE % (index, index) for index in range(lines))
+
+    for index in range(files):
+        parts = ["d%d" % generator.randrange(fan_out) for _ in range(depth)]
+        directory = os.path.join(os.path.abspath(root), *parts)
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        path = os.path.join(directory, "file%d.conf" % index)
+
+        with open(path, "w") as target:
+            target.write(content)
+
+        paths.append(path)
+
+    return sorted(paths)
+
+
+def text_parameter(size):
+    """
+    :return:    a text parameter of about the given size, in lines.
+    """
+    lines = []
+    length = 0
+
+    while length < size:
+        line = "    some text for line %d" % len(lines)
+        lines.append(line)
+        length += len(line) + 1
+
+    return "{\n%s\n}" % "\n".join(lines)
+
+
+def generate_script(paths, commands, tokens=1, text_size=64, seed=0):
+    """
+    Builds a script cycling over EDIT REPLACE, EDIT APPEND and FILE CHMOD
+    commands, each one over random files of the given ones.
+
+    :param paths:       the files the commands work with, may be fake ones
+                        when the script is only parsed.
+    :param commands:    amount of commands.
+    :param tokens:      files per command.
+    :param text_size:   size of the text parameters, in bytes.
+    :param seed:        seed of the files each command takes.
+    :return:            the script.
+    """
+    generator = random.Random(seed)
+    text = text_parameter(text_size)
+    lines = []
+
+    for index in range(commands):
+        files = " ".join("'%s'" % path for path in
+                         generator.sample(paths, min(tokens, len(paths))))
+        kind = index % 3
+
+        if kind == 0:
+            lines.append("# command %d" % index)
+            lines.append("EDIT %s REPLACE (key%d = .*) %s" %
+                         (files, index % 50, text))
+        elif kind == 1:
+            lines.append("EDIT %s APPEND %s" % (files, text))
+        else:
+            lines.append("FILE %s CHMOD (%s)" %
+                         (files, "640" if index % 2 else "644"))
+
+    return "\n".join(lines) + "\n"
+
+
+def fake_paths(amount):
+    return ["/srv/generated/d%d/file%d.conf" % (index % 16, index)
+            for index in range(amount)]
@@ -0,0 +1,238 @@
+"""
+Benchmarks of the parser and the director over synthetic scripts and trees.
+
+Run from the root of the project:
+
+    python -m benchmarks.run [--quick] [--output results.json]
+    python -m benchmarks.run --save-baseline
+
+Every measure is compared with benchmarks/baseline.json, if there is one, and
+the ones slower than the threshold are reported as regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from fsdir.fsdirector import FSDirector
+from fsdir.parser import FSDirParser
+from fsdir.parser.elements import ElementParser
+from fsdir.parser.regextokenizer import RegexTokenizer
+from fsdir.parser.tokenizer import Tokenizer
+
+from benchmarks import generators
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "baseline.json")
+
+MB = 1024.0 * 1024.0
+
+# each case is a script, and a tree when it's run and not only parsed.
+CASES = [
+    {
+        "name": "big-script",
+        "script": {"commands": 20000, "tokens": 3, "text_size": 128},
+    },
+    {
+        "name": "small-files",
+        "tree": {"files": 2000, "size": 1024},
+        "script": {"commands": 600, "tokens": 4, "text_size": 64},
+    },
+    {
+        "name": "huge-files",
+        "tree": {"files": 4, "size": 8 * 1024 * 1024},
+        "script": {"commands": 12, "tokens": 1, "text_size": 4096},
+    },
+]
+
+
+def make_director(sandbox_dir):
+    director = FSDirector()
+    director.sandbox_dir = sandbox_dir
+
+    director.load_plugins()
+
+    return director
+
+
+def timed(function, *args):
+    started = time.time()
+    function(*args)
+    return time.time() - started
+
+
+def scaled(parameters, scale):
+    return dict((key, max(1, int(value * scale)))
+                if key in ("commands", "files") else (key, value)
+                for key, value in parameters.iteritems())
+
+
+def run_case(case, work_dir, repeat, scale):
+    """
+    :return:    dict of measure name -> (seconds, rate, unit), the seconds
+                are the best of every repetition.
+    """
+    tree = case.get("tree")
+    tree_dir = os.path.join(work_dir, "tree")
+    script_parameters = scaled(case["script"], scale)
+
+    if tree:
+        tree = scaled(tree, scale)
+        paths = generators.generate_tree(tree_dir, **tree)
+    else:
+        paths = generators.fake_paths(script_parameters["commands"])
+
+    script = generators.generate_script(paths, **script_parameters)
+    script_mb = len(script) / MB
+    commands = script_parameters["commands"]
+
+    best = {}
+
+    def measure(name, seconds, amount, unit):
+        if name not in best or seconds < best[name][0]:
+            best[name] = (seconds, amount / seconds if seconds else 0.0, unit)
+
+    for _ in range(repeat):
+        tokens = []
+
+        measure("tokenize", timed(
+            lambda: tokens.append(RegexTokenizer(script).tokens)),
+            script_mb, "MB/s")
+        measure("tokenize-legacy", timed(Tokenizer, script), script_mb, "MB/s")
+        measure("elements", timed(ElementParser, tokens[0]), commands,
+                "commands/s")
+        measure("parse_s", timed(FSDirParser().parse_s, script), commands,
+                "commands/s")
+
+        if not tree:
+            continue
+
+        if os.path.isdir(tree_dir):
+            shutil.rmtree(tree_dir)
+
+        generators.generate_tree(tree_dir, **tree)
+        tree_mb = tree["files"] * tree["size"] / MB
+
+        director = make_director(os.path.join(work_dir, "sandbox"))
+        director.loads(script)
+
+        measure("validate", timed(director.validate), commands, "commands/s")
+        measure("sandbox_run", timed(director.sandbox_run), tree_mb, "MB/s")
+        measure("apply", timed(director.apply), tree_mb, "MB/s")
+
+    return best
+
+
+def compare(results, baseline, threshold, min_seconds):
+    """
+    Prints every measure next to its baseline.
+
+    :return:    the (case, measure) pairs slower than the baseline by more
+                than the threshold, measures too short to be reliable are
+                never reported.
+    """
+    regressions = []
+
+    print "%-12s %-16s %12s %12s %10s %-10s %8s" % (
+        "case", "measure", "seconds", "baseline", "rate", "", "change")
+
+    for case, measures in sorted(results.iteritems()):
+        for name, (seconds, rate, unit) in sorted(measures.iteritems()):
+            old = baseline.get(case, {}).get(name)
+            change = ""
+            flag = ""
+
+            if old:
+                ratio = seconds / old[0] if old[0] else 1.0
+                change = "%+.0f%%" % ((ratio - 1) * 100)
+
+                if ratio > 1 + threshold and seconds >= min_seconds:
+                    regressions.append((case, name))
+                    flag = "  REGRESSION"
+
+            print "%-12s %-16s %12.4f %12s %10.2f %-10s %8s%s" % (
+                case, name, seconds, "%.4f" % old[0] if old else "-", rate,
+                unit, change, flag)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FileSystem Director "
+                                                 "benchmarks")
+
+    parser.add_argument('-o', '--output', help='Write the results as JSON')
+    parser.add_argument('-b', '--baseline', default=BASELINE,
+                        help='Results to compare with')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the new baseline')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Repetitions of each case, the best one counts')
+    parser.add_argument('-t', '--threshold', type=float, default=0.5,
+                        help='Slowdown over the baseline reported, 0.5 is '
+                             '50%% slower')
+    parser.add_argument('--min-seconds', type=float, default=0.01,
+                        help='Measures shorter than this are never reported')
+    parser.add_argument('-q', '--quick', action='store_true',
+                        help='Run the cases with a tenth of their size')
+    parser.add_argument('-c', '--case', action='append',
+                        help='Only run the given cases')
+
+    args = parser.parse_args()
+    scale = 0.1 if args.quick else 1.0
+
+    results = {}
+
+    for case in CASES:
+        if args.case and case["name"] not in args.case:
+            continue
+
+        work_dir = tempfile.mkdtemp(prefix="fsdir-bench-")
+
+        try:
+            results[case["name"]] = run_case(case, work_dir, args.repeat,
+                                             scale)
+        finally:
+            shutil.rmtree(work_dir)
+
+    document = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": results,
+    }
+
+    baseline = {}
+
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as source:
+            stored = json.load(source)
+
+        # sizes differ between quick and full runs.
+        if stored.get("quick") == args.quick:
+            baseline = stored["results"]
+
+    regressions = compare(results, baseline, args.threshold,
+                          args.min_seconds)
+
+    if args.output:
+        with open(args.output, "w") as target:
+            json.dump(document, target, indent=2, sort_keys=True,
+                      separators=(",", ": "))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as target:
+            json.dump(document, target, indent=2, sort_keys=True,
+                      separators=(",", ": "))
+
+    if regressions:
+        print "%d measures regressed." % len(regressions)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import json
+import os
+import socket
+import sys
+
+# thin client of the daemon started with "main.py serve", it takes the same
+# arguments as main.py, plus --socket PATH, and runs them in the daemon.
+
+
+def main(argv):
+    socket_path = os.environ.get("FSDIR_SOCKET",
+                                 "/tmp/fsdir-%d.sock" % os.getuid())
+
+    if len(argv) > 1 and argv[0] == "--socket":
+        socket_path = argv[1]
+        argv = argv[2:]
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        connection.connect(socket_path)
+    except socket.error as e:
+        sys.stderr.write("Cannot connect to %s: %s\n" % (socket_path, e))
+        return 2
+
+    connection.sendall(json.dumps({"argv": argv, "cwd": os.getcwd()}) + "\n")
+
+    response = connection.makefile("rb").readline()
+    connection.close()
+
+    if not response:
+        sys.stderr.write("The daemon closed the connection.\n")
+        return 2
+
+    response = json.loads(response)
+
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+
+    return response["status"]
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,225 @@
+import errno
+import hashlib
+import os
+
+from fsdir.state import VirtualState
+from fsdir.util.atomicfile import create_temp
+
+
+def _hash_file(source, block_size=1 << 20):
+    digest = hashlib.sha1()
+
+    for block in iter(lambda: source.read(block_size), ""):
+        digest.update(block)
+
+    return digest.digest()
+
+
+class Applier(object):
+    """
+    Copies the changes of the sandbox into the real file system. Only the
+    files changed by the sandbox run are visited, and files whose content
+    didn't change only get their mode updated.
+
+    Every new content is first written to a temporary file next to its
+    target, synced, and then renamed over the target, so a target is either
+    the old or the new file, never a partial one.
+    """
+
+    def __init__(self, dummy_fs, sandbox_dir, batch_size=64):
+        """
+        :param dummy_fs:        the dummy file system, in sandbox mode.
+        :param sandbox_dir:     the sandbox directory.
+        :param batch_size:      files written before syncing and renaming.
+        """
+        self.dummy_fs = dummy_fs
+        self.sandbox_dir = sandbox_dir
+        self.batch_size = batch_size
+
+        self.written = []
+        self.chmoded = []
+        self.removed = []
+
+    def changes(self):
+        """
+        :return:    list of (absolute path, status), taken from the state of
+                    the dummy file system.
+        """
+        state = self.dummy_fs.state
+
+        return sorted((path, state.status(path)) for path in state.paths())
+
+    def apply(self):
+        """
+        Raises an AssertionError naming the files already applied if one of
+        them fails. Applying the same sandbox again finishes the job, the
+        files already applied are found unchanged.
+
+        :return:    the list of real paths that were written, changed their
+                    mode or were removed.
+        """
+        batch = []
+
+        try:
+            self._apply_changes(batch)
+        except Exception as e:
+            self._discard(batch)
+            applied = self.written + self.chmoded + self.removed
+
+            if not applied:
+                raise
+
+            raise AssertionError(
+                "Applying failed (%s: %s) after these files were applied: %s."
+                " Apply the sandbox again to finish." %
+                (e.__class__.__name__, e, ", ".join(applied))
+            )
+
+        return self.written + self.chmoded + self.removed
+
+    def _apply_changes(self, batch):
+        backend = self.dummy_fs.backend
+        stat_cache = self.dummy_fs.stat_cache
+
+        for path, status in self.changes():
+            canonical_path = self.dummy_fs.get_canonical_path(path)
+
+            if status == VirtualState.REMOVED:
+                if stat_cache.isfile(path):
+                    os.remove(path)
+                    stat_cache.update(path)
+                    self.removed.append(path)
+
+                continue
+
+            if not backend.isfile(canonical_path):
+                continue
+
+            mode = backend.get_mode(canonical_path)
+
+            if self._same_content(canonical_path, path):
+                if mode is not None and mode != self._get_mode(path):
+                    os.chmod(path, mode)
+                    stat_cache.update(path)
+                    self.chmoded.append(path)
+
+                continue
+
+            batch.append(self._write_temp(canonical_path, path, mode))
+
+            if len(batch) >= self.batch_size:
+                self._commit(batch)
+
+        self._commit(batch)
+
+    @staticmethod
+    def _discard(batch):
+        for temp_path, fd, _ in batch:
+            os.close(fd)
+            os.remove(temp_path)
+
+    def _get_mode(self, path):
+        return self.dummy_fs.stat_cache.stat(path).st_mode & 07777
+
+    def _same_content(self, canonical_path, path):
+        backend = self.dummy_fs.backend
+
+        if not self.dummy_fs.stat_cache.isfile(path):
+            return False
+
+        with backend.open(canonical_path, "rb") as new_source:
+            new_source.seek(0, os.SEEK_END)
+            size = new_source.tell()
+
+            if size != self.dummy_fs.stat_cache.stat(path).st_size:
+                return False
+
+            new_source.seek(0)
+            new_hash = _hash_file(new_source)
+
+        with open(path, "rb") as old_source:
+            return new_hash == _hash_file(old_source)
+
+    def _write_temp(self, canonical_path, path, mode):
+        """
+        Writes the new content next to its target, without syncing it yet.
+
+        :return:    (temporary path, file descriptor, target path).
+        """
+        directory = os.path.dirname(path)
+
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        else:
+            self._update_directories(directory)
+
+        if mode is None and self.dummy_fs.stat_cache.isfile(path):
+            mode = self._get_mode(path)
+
+        # new files keep the mode they are created with.
+        fd, temp_path = create_temp(directory, ".%s." % os.path.basename(path))
+
+        try:
+            with self.dummy_fs.backend.open(canonical_path, "rb") as source:
+                for block in iter(lambda: source.read(1 << 20), ""):
+                    while block:
+                        block = block[os.write(fd, block):]
+
+            if mode is not None:
+                os.fchmod(fd, mode)
+        except Exception:
+            os.close(fd)
+            os.remove(temp_path)
+            raise
+
+        return temp_path, fd, path
+
+    def _update_directories(self, directory):
+        """
+        Lets the stat cache know about the new directory, and any of its
+        parents that makedirs may have created too.
+        """
+        parent = os.path.dirname(directory)
+
+        while parent != directory:
+            self.dummy_fs.stat_cache.update(directory)
+            directory, parent = parent, os.path.dirname(parent)
+
+    def _commit(self, batch):
+        """
+        Syncs every temporary file of the batch, renames them over their
+        targets, and finally syncs each directory once.
+        """
+        if not batch:
+            return
+
+        for _, fd, _ in batch:
+            os.fsync(fd)
+
+        directories = set()
+
+        while batch:
+            temp_path, fd, path = batch.pop(0)
+
+            os.close(fd)
+
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                os.remove(temp_path)
+                raise
+            self.dummy_fs.stat_cache.update(path)
+
+            directories.add(os.path.dirname(path))
+            self.written.append(path)
+
+        for directory in directories:
+            dir_fd = os.open(directory, os.O_RDONLY)
+
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
@@ -0,0 +1,368 @@
+import errno
+import fcntl
+import io
+import mmap
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+from fsdir.statcache import StatCache
+from fsdir.util.atomicfile import AtomicFile
+
+# ioctl request number of FICLONE (linux/fs.h), shares the extents of a file
+# with another one on filesystems that support it (btrfs, xfs, ...).
+FICLONE = 0x40049409
+
+
+def clone_file(source_path, target_path):
+    """
+    Copies a file as cheap as the underlying file system allows it: a reflink
+    when supported, a regular copy otherwise. The permission bits are always
+    copied.
+
+    :param source_path:     the file to clone.
+    :param target_path:     where to put the clone.
+    :return:                True if the file was reflinked.
+    """
+    cloned = False
+
+    with open(source_path, "rb") as source:
+        with open(target_path, "wb") as target:
+            try:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+                cloned = True
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY,
+                                   errno.EXDEV, errno.EINVAL, errno.EBADF):
+                    raise
+
+                shutil.copyfileobj(source, target)
+
+    shutil.copymode(source_path, target_path)
+    return cloned
+
+
+def map_path(file_path):
+    """
+    Maps a whole file into memory, read-only.
+
+    :param file_path:   the file to map.
+    :return:            the mmap, or an empty string for empty files (they
+                        can't be mapped).
+    """
+    with open(file_path, "rb") as source:
+        if os.fstat(source.fileno()).st_size == 0:
+            return ""
+
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class SandboxOutput(AtomicFile):
+    """
+    AtomicFile recording its target in the stat cache once replaced.
+    """
+
+    def __init__(self, stat_cache, target_path, mode_path=None):
+        super(SandboxOutput, self).__init__(target_path, mode_path)
+        self.stat_cache = stat_cache
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        super(SandboxOutput, self).close()
+        self.stat_cache.add_file(self.target_path)
+
+
+class DiskBackend(object):
+    """
+    Keeps the sandbox files as real files, under the sandbox directory.
+
+    The original files and the sandbox ones are looked up through the stat
+    cache, which learns about every sandbox file written or removed.
+    """
+
+    # other processes can read and write the sandbox files.
+    on_disk = True
+
+    def __init__(self, stat_cache=None):
+        # directories already known to exist.
+        self._dirs = set()
+
+        self.stat_cache = stat_cache or StatCache()
+
+    def isfile(self, canonical_path):
+        return self.stat_cache.isfile(canonical_path)
+
+    def open(self, canonical_path, mode):
+        opened = open(canonical_path, mode)
+
+        if not mode.startswith("r") or "+" in mode:
+            self.stat_cache.add_file(canonical_path)
+
+        return opened
+
+    def map(self, canonical_path):
+        return map_path(canonical_path)
+
+    def materialize(self, file_path, canonical_path, copy=True, clone=True):
+        """
+        Creates the sandbox version of a file.
+
+        :param file_path:       the original file, absolute, may not exist.
+        :param canonical_path:  the path of the sandbox version.
+        :param copy:            whether the content is needed.
+        :param clone:           whether reflinks can be used to copy.
+        """
+        self._make_dirs(canonical_path)
+
+        if not self.stat_cache.isfile(file_path):
+            # a new file, there's nothing to copy.
+            return
+
+        if not clone:
+            shutil.copy(file_path, canonical_path)
+        elif copy:
+            clone_file(file_path, canonical_path)
+        else:
+            open(canonical_path, "w").close()
+            shutil.copymode(file_path, canonical_path)
+
+        self.stat_cache.add_file(canonical_path)
+
+    def open_output(self, file_path, canonical_path):
+        """
+        Opens the sandbox version of a file to be fully rewritten, it's only
+        replaced when the returned file is closed so the current version can
+        still be read meanwhile.
+        """
+        self._make_dirs(canonical_path)
+
+        if self.isfile(canonical_path):
+            mode_path = canonical_path
+        elif self.stat_cache.isfile(file_path):
+            mode_path = file_path
+        else:
+            mode_path = None
+
+        return SandboxOutput(self.stat_cache, canonical_path, mode_path)
+
+    def output_path(self, canonical_path):
+        """
+        Prepares the path so the file can be written by someone else. It's
+        taken as written already: nothing reads it before the writer is done.
+        """
+        self._make_dirs(canonical_path)
+        self.stat_cache.add_file(canonical_path)
+        return canonical_path
+
+    def _make_dirs(self, canonical_path):
+        basedir = os.path.dirname(canonical_path)
+
+        if basedir not in self._dirs:
+            try:
+                os.makedirs(basedir)
+            except OSError as e:
+                # may have been created meanwhile by another step.
+                if e.errno != errno.EEXIST:
+                    raise
+
+            self._dirs.add(basedir)
+
+    def chmod(self, canonical_path, mode):
+        os.chmod(canonical_path, mode)
+
+    def get_mode(self, canonical_path):
+        return stat.S_IMODE(os.stat(canonical_path).st_mode)
+
+    def remove(self, canonical_path):
+        os.remove(canonical_path)
+        self.stat_cache.remove_file(canonical_path)
+
+    def paths(self, root):
+        for dir_path, _, file_names in os.walk(root):
+            for file_name in file_names:
+                yield os.path.join(dir_path, file_name)
+
+    def release(self):
+        pass
+
+
+class MemoryEntry(object):
+    def __init__(self, mode=None):
+        self.data = None
+        self.spill_path = None
+        self.mode = mode
+        self.size = 0
+
+
+class MemoryFile(io.BytesIO):
+    """
+    File object over the content of a memory entry, stores the content back
+    into the backend when closed.
+    """
+
+    def __init__(self, backend, canonical_path, initial, mode=None):
+        super(MemoryFile, self).__init__(initial)
+
+        self._backend = backend
+        self._canonical_path = canonical_path
+        self._mode = mode
+
+    def close(self):
+        if not self.closed:
+            self._backend.store(self._canonical_path, self.getvalue())
+
+            if self._mode is not None:
+                self._backend.chmod(self._canonical_path, self._mode)
+
+        super(MemoryFile, self).close()
+
+
+class MemoryBackend(object):
+    """
+    Keeps the sandbox as an in-memory overlay: canonical path to content and
+    mode. When a cap is given, content that does not fit anymore is spilled to
+    a temporary directory.
+    """
+
+    on_disk = False
+
+    def __init__(self, cap=None, stat_cache=None):
+        self.entries = {}
+        self.cap = cap
+        self.size = 0
+
+        # looks up the original files.
+        self.stat_cache = stat_cache or StatCache()
+
+        self._spill_dir = None
+        self._lock = threading.Lock()
+
+    def isfile(self, canonical_path):
+        return canonical_path in self.entries
+
+    def open(self, canonical_path, mode):
+        data = self.read(canonical_path)
+
+        if mode.startswith("r") and "+" not in mode:
+            return io.BytesIO(data)
+
+        if mode.startswith("w"):
+            data = ""
+
+        memory_file = MemoryFile(self, canonical_path, data)
+
+        if mode.startswith("a"):
+            memory_file.seek(0, os.SEEK_END)
+
+        return memory_file
+
+    def map(self, canonical_path):
+        return self.read(canonical_path)
+
+    def read(self, canonical_path):
+        entry = self.entries[canonical_path]
+
+        if entry.spill_path:
+            with open(entry.spill_path, "rb") as source:
+                return source.read()
+
+        return entry.data
+
+    def store(self, canonical_path, data):
+        with self._lock:
+            self._store(canonical_path, data)
+
+    def _store(self, canonical_path, data):
+        entry = self.entries.setdefault(canonical_path, MemoryEntry())
+
+        if entry.spill_path:
+            os.remove(entry.spill_path)
+            entry.spill_path = None
+        else:
+            self.size -= entry.size
+
+        entry.size = len(data)
+
+        if self.cap is not None and self.size + entry.size > self.cap:
+            entry.data = None
+            entry.spill_path = self._spill(data)
+        else:
+            entry.data = data
+            self.size += entry.size
+
+    def _spill(self, data):
+        if not self._spill_dir:
+            self._spill_dir = tempfile.mkdtemp(prefix="fsdir-")
+
+        fd, spill_path = tempfile.mkstemp(dir=self._spill_dir)
+        with os.fdopen(fd, "wb") as target:
+            target.write(data)
+
+        return spill_path
+
+    def materialize(self, file_path, canonical_path, copy=True, clone=True):
+        data = ""
+        mode = self._original_mode(file_path)
+
+        if mode is not None and copy:
+            with open(file_path, "rb") as source:
+                data = source.read()
+
+        self.store(canonical_path, data)
+        self.entries[canonical_path].mode = mode
+
+    def open_output(self, file_path, canonical_path):
+        mode = None
+
+        # the entry is only stored when closed, the current content can still
+        # be read meanwhile.
+        if not self.isfile(canonical_path):
+            mode = self._original_mode(file_path)
+
+        return MemoryFile(self, canonical_path, "", mode)
+
+    def _original_mode(self, file_path):
+        """
+        :return:    the permission bits of the original file, None if it does
+                    not exist.
+        """
+        info = self.stat_cache.stat(file_path)
+
+        if info is not None and stat.S_ISREG(info.st_mode):
+            return stat.S_IMODE(info.st_mode)
+
+        return None
+
+    def chmod(self, canonical_path, mode):
+        self.entries[canonical_path].mode = mode
+
+    def get_mode(self, canonical_path):
+        """
+        :return:    the mode of the entry, None if it's a new file that never
+                    got one.
+        """
+        return self.entries[canonical_path].mode
+
+    def remove(self, canonical_path):
+        with self._lock:
+            entry = self.entries.pop(canonical_path)
+
+            if entry.spill_path:
+                os.remove(entry.spill_path)
+            else:
+                self.size -= entry.size
+
+    def paths(self, root):
+        return sorted(self.entries)
+
+    def release(self):
+        if self._spill_dir:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+        self.entries = {}
+        self.size = 0
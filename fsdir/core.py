@@ -1,5 +1,9 @@
-import os
-import shutil
+import io
+import stat
+
+from fsdir.backends import DiskBackend, map_path
+from fsdir.state import VirtualState
+from fsdir.statcache import StatCache
 
 
 class DummyFileSystem(object):
@@ -13,19 +17,48 @@ class DummyFileSystem(object):
     """
 
     def __init__(self):
-        self.temp_files = []
+        self.state = VirtualState()
+
+        # what is known of the real file system, shared by every operation.
+        self.stat_cache = StatCache()
         self._prefix = ""
         self._sandbox = False
 
-    def begin_sandbox(self, sb_dir):
+        self.backend = DiskBackend(self.stat_cache)
+
+        # defer copying files into the sandbox until they are written.
+        self.copy_on_write = True
+
+        # counts the bytes going through the files opened, when profiling.
+        self.profiler = None
+
+        # holds the original files read ahead of time, if any.
+        self.prefetcher = None
+
+        # canonical paths of the sandbox files left by a previous run and not
+        # written by this one yet. They are never read, only kept when a
+        # result turns out to be the same.
+        self.stale = set()
+
+    def begin_sandbox(self, sb_dir, backend=None):
         """
         Start the dummy file system using a sandbox directory.
 
         :param sb_dir:
+        :param backend:     where the sandbox files are kept, on disk by
+                            default.
         """
         self._prefix = sb_dir
         self._sandbox = True
 
+        if backend:
+            self.backend = backend
+
+        # the backend looks files up through the same cache, which can't trust
+        # what it knew of the sandbox: another run may have changed it.
+        self.backend.stat_cache = self.stat_cache
+        self.stat_cache.forget(sb_dir)
+
     def end_sandbox(self):
         """
         Stops the sandbox behavior.
@@ -35,6 +68,9 @@ class DummyFileSystem(object):
         self._prefix = ""
         self._sandbox = False
 
+        self.backend.release()
+        self.backend = DiskBackend(self.stat_cache)
+
     def is_sandbox(self):
         return self._sandbox
 
@@ -46,15 +82,32 @@ class DummyFileSystem(object):
         :param file_path:   the path to be registered.
         :return:
         """
-        self.temp_files.append(self.get_canonical_path(file_path))
+        self.state.create(self.state.abspath(file_path))
+
+    def unregister_file(self, file_path):
+        """
+        Registers the removal of a file, so it's no longer found.
+
+        :param file_path:   the path to be unregistered.
+        """
+        self.state.remove(self.state.abspath(file_path))
 
     def isfile(self, file_path):
-        abs_path = self.get_canonical_path(file_path)
-        return os.path.isfile(file_path) or abs_path in self.temp_files
+        abs_path = self.state.abspath(file_path)
+        status = self.state.status(abs_path)
+
+        if status is None:
+            return self.stat_cache.isfile(abs_path)
+
+        return status != VirtualState.REMOVED
+
+    def isdir(self, file_path):
+        abs_path = self.state.abspath(file_path)
+
+        return self.state.isdir(abs_path) or self.stat_cache.isdir(abs_path)
 
     def exists(self, file_path):
-        abs_path = self.get_canonical_path(file_path)
-        return os.path.exists(file_path) or abs_path in self.temp_files
+        return self.isfile(file_path) or self.isdir(file_path)
 
     def get_canonical_path(self, file_path):
         """
@@ -64,32 +117,243 @@ class DummyFileSystem(object):
         :param file_path:       the path to be converted.
         :return:                the canonical path.
         """
-        # TODO: this may need a revision.
-        return self._prefix + os.path.abspath(file_path)
+        return self._prefix + self.state.abspath(file_path)
 
     def open_file(self, file_path, mode="r"):
-        canonical_path = self.get_canonical_path(file_path)
+        source = self._open_file(file_path, mode)
 
-        basedir = os.path.dirname(canonical_path)
-        if not os.path.exists(basedir):
-            os.makedirs(basedir)
+        if self.profiler:
+            return self.profiler.wrap(file_path, source)
+
+        return source
+
+    def _open_file(self, file_path, mode):
+        canonical_path = self.get_canonical_path(file_path)
 
         # check that the file was not previously copied.
-        if not os.path.isfile(canonical_path):
-            shutil.copy(file_path, canonical_path)
+        if not self._in_sandbox(canonical_path):
+            if self.copy_on_write and self._is_read_only(mode):
+                # nothing will be written, so the original file is enough.
+                data = self._take_prefetched(file_path)
+
+                if data is not None:
+                    return io.BytesIO(data)
+
+                return open(file_path, mode)
+
+            self.materialize(file_path, copy=not self._is_truncating(mode))
+
+        return self.backend.open(canonical_path, mode)
+
+    def map_file(self, file_path):
+        """
+        Maps the current content of a file into memory, without copying it
+        into the sandbox.
+
+        :param file_path:   the path of the file.
+        :return:            a read-only buffer, close it if it has a close()
+                            method.
+        """
+        canonical_path = self.get_canonical_path(file_path)
+
+        if self._in_sandbox(canonical_path):
+            buf = self.backend.map(canonical_path)
+        else:
+            buf = self._take_prefetched(file_path)
+
+            if buf is None:
+                buf = map_path(file_path)
+
+        if self.profiler:
+            self.profiler.count_read(file_path, len(buf))
+
+        return buf
+
+    def _take_prefetched(self, file_path):
+        if self.prefetcher:
+            return self.prefetcher.take(self.state.abspath(file_path))
+
+        return None
+
+    def _discard_prefetched(self, file_path):
+        # the sandbox holds the file from now on.
+        if self.prefetcher:
+            self.prefetcher.discard(self.state.abspath(file_path))
+
+    def materialize(self, file_path, copy=True):
+        """
+        Makes the sandbox version of a file, if it does not exist yet.
+
+        :param file_path:   the path of the file.
+        :param copy:        whether the content is needed or the file will be
+                            truncated anyway.
+        """
+        canonical_path = self.get_canonical_path(file_path)
+
+        if not self._in_sandbox(canonical_path):
+            self._drop_stale(canonical_path)
+            self.backend.materialize(self.state.abspath(file_path),
+                                     canonical_path, copy=copy,
+                                     clone=self.copy_on_write)
+
+        self._discard_prefetched(file_path)
+        self.state.modify(self.state.abspath(file_path))
+
+    def is_on_disk(self):
+        """
+        Whether the sandbox files are real files, that other processes can
+        work with through source_path() and output_path().
+        """
+        return self.backend.on_disk
+
+    def has_content(self, file_path):
+        """
+        Whether the file physically exists, in the sandbox or the file system.
+        Registered files don't exist until created.
+        """
+        return self._in_sandbox(self.get_canonical_path(file_path)) or \
+            self.stat_cache.isfile(self.state.abspath(file_path))
+
+    def get_mode(self, file_path):
+        """
+        :return:    the current permission bits of the file, None if unknown.
+        """
+        canonical_path = self.get_canonical_path(file_path)
+
+        if self._in_sandbox(canonical_path):
+            return self.backend.get_mode(canonical_path)
+
+        info = self.stat_cache.stat(self.state.abspath(file_path))
+
+        if info is not None and stat.S_ISREG(info.st_mode):
+            return stat.S_IMODE(info.st_mode)
+
+        return None
+
+    def source_path(self, file_path):
+        """
+        :return:    the path holding the current content of the file.
+        """
+        canonical_path = self.get_canonical_path(file_path)
+
+        if self._in_sandbox(canonical_path):
+            return canonical_path
+
+        return file_path
+
+    def output_path(self, file_path):
+        """
+        :return:    the path where the new content of the file goes, only for
+                    backends on disk.
+        """
+        canonical_path = self.get_canonical_path(file_path)
+
+        self._drop_stale(canonical_path)
+        self.state.modify(self.state.abspath(file_path))
+        return self.backend.output_path(canonical_path)
+
+    def open_output(self, file_path):
+        """
+        Opens a file to be fully rewritten while its current content may still
+        be read, the new content replaces the old one when closed.
+
+        :param file_path:   the path of the file.
+        :return:            a writable file object.
+        """
+        canonical_path = self.get_canonical_path(file_path)
 
-        return open(canonical_path, mode)
+        self._drop_stale(canonical_path)
+        output = self.backend.open_output(self.state.abspath(file_path),
+                                          canonical_path)
+
+        self._discard_prefetched(file_path)
+        self.state.modify(self.state.abspath(file_path))
+
+        if self.profiler:
+            return self.profiler.wrap(file_path, output)
+
+        return output
+
+    def remove_file(self, file_path):
+        canonical_path = self.get_canonical_path(file_path)
+
+        self._drop_stale(canonical_path)
+
+        if self._in_sandbox(canonical_path):
+            self.backend.remove(canonical_path)
+
+        self._discard_prefetched(file_path)
+        self.state.remove(self.state.abspath(file_path))
+        self._update_real(file_path)
+
+    def _in_sandbox(self, canonical_path):
+        return canonical_path not in self.stale and \
+            self.backend.isfile(canonical_path)
+
+    def mark_stale(self, canonical_paths):
+        """
+        Takes the sandbox files as left by a previous run, to be written again
+        or dropped.
+        """
+        self.stale = set(canonical_paths)
+
+    def is_stale(self, file_path):
+        return self.get_canonical_path(file_path) in self.stale
+
+    def keep_stale(self, file_path):
+        """
+        Keeps the stale sandbox file as it is, its content is already the one
+        this run would write.
+        """
+        self.stale.discard(self.get_canonical_path(file_path))
+        self.state.modify(self.state.abspath(file_path))
+
+    def _drop_stale(self, canonical_path):
+        if canonical_path in self.stale:
+            self.stale.discard(canonical_path)
+            self.backend.remove(canonical_path)
+
+    def drop_stale(self):
+        """
+        Removes the stale files this run didn't keep.
+        """
+        for canonical_path in self.stale:
+            self.backend.remove(canonical_path)
+
+        self.stale = set()
+
+    def _update_real(self, file_path):
+        """
+        Outside of a sandbox the operations change the real file system, so
+        what the stat cache knows of the path is refreshed.
+        """
+        if not self._sandbox:
+            self.stat_cache.update(self.state.abspath(file_path))
+
+    @staticmethod
+    def _is_read_only(mode):
+        return mode.startswith("r") and "+" not in mode
+
+    @staticmethod
+    def _is_truncating(mode):
+        return mode.startswith("w")
 
     def create_file(self, file_path):
-        # add a second security.
-        if os.path.isfile(file_path):
+        # add a second security, the same view validation had: files removed
+        # before may be created again.
+        removed = self.state.status(self.state.abspath(file_path)) == \
+            VirtualState.REMOVED
+
+        if not removed and self.has_content(file_path):
             raise ValueError("Creation failed: %s already exists." % file_path)
 
         self.open_file(file_path, mode="w").close()
+        self._update_real(file_path)
 
     def chmod(self, file_path, mode):
-        self.open_file(file_path).close()
-        os.chmod(self.get_canonical_path(file_path), mode)
+        self.materialize(file_path)
+        self.backend.chmod(self.get_canonical_path(file_path), mode)
+        self._update_real(file_path)
 
 
 class Instruction(object):
@@ -119,6 +383,40 @@ class Directive(Instruction):
     def repeat_each_file(self):
         raise NotImplementedError
 
+    def is_fusable(self):
+        """
+        Whether consecutive commands of this directive over the same files can
+        share a single begin() and end(), running every procedure in between.
+        """
+        return False
+
+    def is_cacheable(self):
+        """
+        Whether the only effect of this directive is the content and mode of
+        its files, so its results can be cached.
+        """
+        return False
+
+    def expands_patterns(self):
+        """
+        Whether tokens with patterns, such as 'conf/**/*.conf', are replaced
+        by the existing files they match.
+        """
+        return True
+
+    def reads_content(self):
+        """
+        Whether the content of the files is read, so it's worth reading it
+        ahead of time.
+        """
+        return False
+
+    def release(self):
+        """
+        Frees what begin() took, once the step is over even if it failed.
+        """
+        pass
+
 
 class Procedure(Instruction):
     """
@@ -133,6 +431,65 @@ class Procedure(Instruction):
     def run(self, dummy_fs, directive, extract):
         raise NotImplementedError
 
+    def get_paths(self, extract):
+        """
+        :return:    the files this procedure touches, besides the ones of its
+                    directive.
+        """
+        return []
+
+    def can_run_files(self, directive):
+        """
+        Whether run_files() can do the whole job of the directive, file by file
+        in separate processes.
+        """
+        return False
+
+    def run_files(self, dummy_fs, file_paths, extract, pool):
+        """
+        :param pool:    the multiprocessing pool of the run.
+        """
+        raise NotImplementedError
+
+
+class LineSource(object):
+    """
+    Lazy iterable over the lines of a file, the file is only opened when
+    iterated.
+    """
+
+    def __init__(self, dummy_fs, file_path):
+        self.dummy_fs = dummy_fs
+        self.file_path = file_path
+
+    def __iter__(self):
+        with self.dummy_fs.open_file(self.file_path, "rb") as source:
+            for line in source:
+                yield line
+
+
+def iter_lines(chunks):
+    """
+    Splits chunks of text into lines, the same way iterating over a file
+    does.
+
+    :param chunks:  iterable of strings, each one may hold any amount of lines.
+    """
+    pending = ""
+
+    for chunk in chunks:
+        if pending:
+            chunk = pending + chunk
+
+        parts = chunk.split("\n")
+        pending = parts.pop()
+
+        for part in parts:
+            yield part + "\n"
+
+    if pending:
+        yield pending
+
 
 class IterativeDirective(Directive):
     def __init__(self):
@@ -142,6 +499,9 @@ class IterativeDirective(Directive):
         self.index = -1
         self.item = None
 
+        # items are iterables of lines consumed once, instead of lists.
+        self.streaming = False
+
     def append(self, item):
         self.__iterable.append(item)
 
@@ -157,15 +517,30 @@ class IterativeDirective(Directive):
         self.item = None
         self.index = -1
 
+    def rewind(self):
+        """
+        Prepares the items for another procedure over the same files.
+        """
+        self.restart()
+
     def get_current(self):
         return self.item
 
+    def is_streaming(self):
+        return self.streaming
+
     def get_index(self):
         return self.index
 
+    def get(self, index):
+        return self.__iterable[index]
+
     def set(self, index, value):
         self.__iterable[index] = value
 
+    def count(self):
+        return len(self.__iterable)
+
     def end(self, dummy_fs, extract):
         raise NotImplementedError
 
@@ -15,6 +15,13 @@ class Create(Directive):
 
         return True
 
+    def is_cacheable(self):
+        return True
+
+    def expands_patterns(self):
+        # the files do not exist yet, tokens are taken as they are.
+        return False
+
     def begin(self, dummy_fs, extract):
         for file_path in extract.tokens:
             dummy_fs.create_file(file_path)
@@ -1,5 +1,7 @@
-from fsdir.core import IterativeDirective, DummyFileSystem
+from fsdir.core import IterativeDirective, DummyFileSystem, LineSource, \
+    iter_lines
 from fsdir.fsdirector import Extract
+from fsdir.piecetable import PieceTable
 
 
 class Edit(IterativeDirective):
@@ -24,20 +26,42 @@ class Edit(IterativeDirective):
 
         return True
 
+    def is_fusable(self):
+        return True
+
+    def rewind(self):
+        """
+        Procedures may leave stream items that are not single lines, split
+        them again so the next procedure sees the lines as if the file was
+        re-read. Piece tables are read line by line anyway.
+        """
+        if self.is_streaming():
+            for index in range(self.count()):
+                self.set(index, iter_lines(self.get(index)))
+
+        super(Edit, self).rewind()
+
+    def is_cacheable(self):
+        return True
+
+    def reads_content(self):
+        return True
+
     def begin(self, dummy_fs, extract):
         """
         :type dummy_fs: DummyFileSystem
         :type extract: Extract
         """
-        # read the file's content.
-        for file_path in extract.tokens:
-            lines = []
+        if self.is_streaming():
+            # lines are read as the procedures consume them.
+            for file_path in extract.tokens:
+                self.append(LineSource(dummy_fs, file_path))
 
-            with dummy_fs.open_file(file_path) as source:
-                for line in source:
-                    lines.append(line)
+            return
 
-            self.append(lines)
+        # edits are kept aside, the content is mapped and never copied.
+        for file_path in extract.tokens:
+            self.append(PieceTable(dummy_fs.map_file(file_path)))
 
     def end(self, dummy_fs, extract):
         """
@@ -49,6 +73,21 @@ class Edit(IterativeDirective):
         for i, file_path in enumerate(extract.tokens):
             lines = self.next()
 
-            with dummy_fs.open_file(file_path, "w+") as source:
-                for line in lines:
-                    source.write(line)
+            # the source may still be read while writing the output.
+            with dummy_fs.open_output(file_path) as target:
+                if self.is_streaming():
+                    for line in lines:
+                        target.write(line)
+                else:
+                    lines.write_to(target)
+
+            if not self.is_streaming():
+                lines.close()
+
+    def release(self):
+        """
+        Closes the mapped files, also when a procedure or the output failed.
+        """
+        if not self.is_streaming():
+            for index in range(self.count()):
+                self.get(index).close()
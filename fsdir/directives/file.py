@@ -18,6 +18,9 @@ class File(IterativeDirective):
 
         return True
 
+    def is_cacheable(self):
+        return True
+
     def begin(self, dummy_fs, extract):
         for file_path in extract.tokens:
             self.append(file_path)
@@ -13,6 +13,9 @@ class Read(Directive):
 
         self.lines = []
 
+    def reads_content(self):
+        return True
+
     def validate(self, dummy_fs, extract, procedure):
         """
         Validate that there's only one file, and that file actually exists.
@@ -36,7 +39,7 @@ class Read(Directive):
         """
         Read each line in the file and store its lines.
         """
-        with dummy_fs.open_file(extract.tokens[0]) as source:
+        with dummy_fs.open_file(extract.tokens[0], "rb") as source:
             for line in source:
                 self.lines.append(line)
 
@@ -21,10 +21,14 @@ class Remove(Directive):
             if not dummy_fs.isfile(file_path):
                 return False
 
+        for file_path in extract.tokens:
+            dummy_fs.unregister_file(file_path)
+
         return True
 
     def begin(self, dummy_fs, extract):
-        pass
+        for file_path in extract.tokens:
+            dummy_fs.remove_file(file_path)
 
     def end(self, dummy_fs, extract):
         pass
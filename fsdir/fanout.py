@@ -0,0 +1,188 @@
+import multiprocessing
+import os
+import time
+
+# director attributes every root runs with. The script is parsed, and
+# compiled, once by the director given.
+OPTIONS = ("memory_sandbox", "memory_cap", "streaming", "fuse", "jobs",
+           "io_threads", "prefetch_bytes", "cache_dir")
+
+# state of each pool worker, set once by _init_worker.
+_worker = {}
+
+
+def rebase(file_path, root):
+    """
+    :return:    the path inside the root, absolute paths are taken as relative
+                to the root too.
+    """
+    return os.path.join(root, file_path.lstrip(os.sep))
+
+
+def rebase_commands(cache, root):
+    """
+    Moves the indexed commands inside the root: the files of their directives
+    and the paths their procedures take, such as the target of COPYTO or the
+    mapping file of TRANSLATE.
+
+    :param cache:   the (directive, procedure, extract) tuples of a director.
+    """
+    for _, procedure, extract in cache:
+        extract.tokens = [rebase(file_path, root)
+                          for file_path in extract.tokens]
+
+        if procedure:
+            sub_extract = extract.sub_extract
+            paths = procedure.get_paths(sub_extract)
+            sub_extract.tokens = [rebase(token, root) if token in paths
+                                  else token for token in sub_extract.tokens]
+
+
+def _init_worker(director_class, registry, options, commands, actions):
+    _worker['director_class'] = director_class
+    _worker['registry'] = registry
+    _worker['options'] = options
+    _worker['commands'] = commands
+    _worker['actions'] = actions
+
+
+def _run_root(task):
+    """
+    Pool task, runs the script against a single root.
+
+    :param task:    (index of the root, root).
+    :return:        dict with the root, the error if it failed, the seconds
+                    taken and the amount of files changed.
+    """
+    index, root = task
+    started = time.time()
+    result = {"root": root, "error": None, "changes": 0}
+
+    director = _worker['director_class']()
+    director.registry = _worker['registry']
+
+    options = dict(_worker['options'])
+    director.dummy_fs.copy_on_write = options.pop('copy_on_write')
+    director.sandbox_dir = os.path.join(options.pop('sandbox_dir'),
+                                        "%d" % index)
+
+    for name, value in options.iteritems():
+        setattr(director, name, value)
+
+    test, apply_sandbox, keep = _worker['actions']
+
+    try:
+        director.index_commands(_worker['commands'])
+        rebase_commands(director.cache, root)
+        director.validate()
+
+        if not test:
+            director.sandbox_run()
+            result["changes"] = len(director.dummy_fs.state.paths())
+
+            if apply_sandbox:
+                result["changes"] = len(director.apply(keep))
+    except Exception as e:
+        result["error"] = "%s: %s" % (e.__class__.__name__, e)
+
+    result["seconds"] = time.time() - started
+
+    return result
+
+
+class FanOut(object):
+    """
+    Runs a script parsed once against many root directories, on a pool of
+    processes. The files of every directive are taken inside each root, so
+    '/etc/app.conf' is '<root>/etc/app.conf'; validation happens for each
+    root, since the files each one holds differ.
+
+    Each root gets its own sandbox, a numbered directory inside the sandbox
+    directory of the director. Roots share the result cache directory, if
+    any. Hooks and the display of the sandbox are not available, as the
+    roots run in other processes.
+    """
+
+    def __init__(self, director, processes=None):
+        """
+        :param director:    director with the plugins and options set.
+        :param processes:   size of the pool, the amount of CPUs by default.
+        """
+        self.director = director
+        self.processes = processes or multiprocessing.cpu_count()
+
+    def options(self):
+        options = dict((name, getattr(self.director, name))
+                       for name in OPTIONS)
+
+        options['copy_on_write'] = self.director.dummy_fs.copy_on_write
+        options['sandbox_dir'] = self.director.sandbox_dir
+
+        return options
+
+    def run(self, commands, roots, test=False, apply_sandbox=False,
+            keep=False):
+        """
+        :param commands:        the parsed script.
+        :param roots:           the root directories.
+        :param test:            only validate the script against each root.
+        :param apply_sandbox:   apply each sandbox to its root.
+        :param keep:            keep the sandboxes after applying them.
+        :return:                a result per root, in the order given.
+        """
+        if self.director.hooks:
+            raise ValueError("Hooks cannot run over many roots, they would "
+                             "run in other processes.")
+
+        if self.director.display:
+            raise ValueError("The sandbox of each root cannot be displayed.")
+
+        initargs = (self.director.__class__, self.director.registry,
+                    self.options(), commands, (test, apply_sandbox, keep))
+        tasks = list(enumerate(roots))
+
+        sandbox_dir = self.director.sandbox_dir
+
+        if not self.director.memory_sandbox and not os.path.isdir(sandbox_dir):
+            os.makedirs(sandbox_dir)
+
+        if self.processes <= 1:
+            _init_worker(*initargs)
+            return [_run_root(task) for task in tasks]
+
+        pool = multiprocessing.Pool(self.processes, initializer=_init_worker,
+                                    initargs=initargs)
+
+        try:
+            return pool.map(_run_root, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def summary(results):
+        """
+        Prints the time and outcome of each root, and the totals.
+        """
+        width = max([len(result["root"]) for result in results] + [4])
+        failed = 0
+
+        print "%-*s  %-6s %9s %8s" % (width, "root", "status", "seconds",
+                                      "changes")
+
+        for result in results:
+            if result["error"]:
+                failed += 1
+                print "%-*s  %-6s %9.3f %8s  %s" % (
+                    width, result["root"], "FAILED", result["seconds"], "-",
+                    result["error"])
+            else:
+                print "%-*s  %-6s %9.3f %8d" % (
+                    width, result["root"], "ok", result["seconds"],
+                    result["changes"])
+
+        print "%d roots, %d ok, %d failed, %.3fs in total" % (
+            len(results), len(results) - failed, failed,
+            sum(result["seconds"] for result in results))
+
+        return failed
@@ -1,17 +1,28 @@
+import multiprocessing
 import os
 import shutil
 import util.treedisplay
-from fsdir.core import DummyFileSystem
-from fsdir.parser import FSDirParser
+from fsdir.applier import Applier
+from fsdir.backends import MemoryBackend
+from fsdir.core import DummyFileSystem, IterativeDirective
+from fsdir.memo import ResultCache
+from fsdir.parser import FSDirParser, compiled
+from fsdir.parser.regextokenizer import RegexTokenizer
+from fsdir.planner import plan
+from fsdir.prefetch import Prefetcher
+from fsdir.registry import PluginRegistry, BUILTIN_MANIFEST
+from fsdir.scheduler import Scheduler
 from fsdir.util import argscontrol
+from fsdir.util.dirindex import DirectoryIndex
 
 
 class Extract(object):
-    def __init__(self, kw, tokens, sub_extract=None):
+    def __init__(self, kw, tokens, sub_extract=None, line=0):
         self.keyword = kw
         self.tokens = tokens
         self.sub_extract = sub_extract
         self.error = None
+        self.line = line
 
 
 class FSDirector(object):
@@ -26,13 +37,74 @@ class FSDirector(object):
     def __init__(self):
         self.cache = []
 
-        self.directives = []
-        self.procedures = []
+        # amount of cached commands already validated, each command is
+        # validated only once.
+        self.validated = 0
+
+        # directives and procedures by keyword, loaded when first used.
+        self.registry = PluginRegistry()
 
         self.dummy_fs = DummyFileSystem()
 
+        # listings shared by every command expanding path patterns.
+        self.dir_index = DirectoryIndex(self.dummy_fs.state)
+
         self.display = False
 
+        # keep the sandbox in memory instead of the sandbox directory, the cap
+        # is the amount of bytes kept in memory before spilling to disk.
+        self.memory_sandbox = False
+        self.memory_cap = None
+
+        # update the files a previous run left in the sandbox directory,
+        # instead of starting from an empty one.
+        self.reuse_sandbox = False
+
+        # iterative directives pass lines through the procedures as streams.
+        self.streaming = False
+
+        # run adjacent commands over the same files in a single pass.
+        self.fuse = True
+
+        # amount of steps run concurrently, when they touch different files.
+        self.jobs = 1
+
+        # processes used by procedures that can work file by file on their
+        # own, e.g. REPLACE over many files, the pool is kept for the whole
+        # run. Steps over fewer files than pool_min_files are not worth
+        # sending to it.
+        self.processes = 1
+        self.pool_min_files = 32
+        self.pool = None
+
+        # threads reading the files of upcoming steps ahead of time, for high
+        # latency file systems, and the bytes they may keep in memory.
+        self.io_threads = 0
+        self.prefetch_bytes = 64 * 1024 * 1024
+
+        # directory where step results are kept between runs, None to always
+        # run every step.
+        self.cache_dir = None
+        self.result_cache = None
+
+        # keep scripts compiled, next to them when the directory is empty.
+        self.compile_scripts = False
+        self.compiled_dir = None
+
+        # class used to tokenize scripts.
+        self.tokenizer_class = RegexTokenizer
+
+        # parsed commands by script hash, kept in memory when not None.
+        self.script_cache = None
+
+        # parse and validate scripts command by command while reading them.
+        self.lazy_parse = False
+
+        # objects with before(phase, extract) and after(phase, extract)
+        # methods, called around each phase of every command: "validate",
+        # "begin", "run" and "end".
+        self.hooks = []
+
     def load(self, file_path):
         """
         Run director from file.
@@ -40,31 +112,97 @@ class FSDirector(object):
         :param file_path:    the path of the .fsdir script.
         :return:
         """
+        if self.lazy_parse and not self.compile_scripts:
+            with open(file_path) as script_file:
+                self.load_stream(script_file)
+
+            return
+
+        self.index_commands(self.parse(file_path))
+
+    def parse(self, file_path):
+        """
+        Parses a script from file, through the caches in use.
+
+        :param file_path:    the path of the .fsdir script.
+        :return:             the list of commands.
+        """
         with open(file_path) as script_file:
             script = script_file.read()
 
-        self.loads(script)
+        if self.script_cache is not None:
+            return self.parse_cached(script)
+
+        if not self.compile_scripts:
+            return FSDirParser(self.tokenizer_class).parse_s(script)
+
+        digest = compiled.script_hash(script)
+        path = compiled.compiled_path(file_path, self.compiled_dir or None)
+
+        commands = compiled.load(path, digest)
+
+        if commands is None:
+            commands = FSDirParser(self.tokenizer_class).parse_s(script)
+            compiled.dump(commands, path, digest)
+
+        return commands
+
+    def parse_cached(self, script):
+        """
+        :return:    the commands of the script, parsed only the first time.
+        """
+        digest = compiled.script_hash(script)
+        commands = self.script_cache.get(digest)
+
+        if commands is None:
+            commands = FSDirParser(self.tokenizer_class).parse_s(script)
+            self.script_cache[digest] = commands
+
+        return commands
+
+    def load_stream(self, script_file):
+        """
+        Run director reading the script as a stream, each command is indexed
+        and validated as soon as it's parsed, without holding the whole script.
+
+        :param script_file:     file object with the script.
+        :return:
+        """
+        parser = FSDirParser(self.tokenizer_class)
+
+        for command in parser.iter_parse(script_file):
+            self.index_command(command)
+            self.validate()
 
     def loads(self, script):
         """
         Run director with a given string.
 
-        :param script:      script as string.
+        :param script:      script as string, unicode scripts are encoded as
+                            UTF-8.
         :return:
         """
-        parser = FSDirParser()
-        commands = parser.parse_s(script)
+        # files are handled as bytes, unicode tokens would force decoding
+        # every line they are compared or joined with.
+        if isinstance(script, unicode):
+            script = script.encode("utf-8")
+
+        parser = FSDirParser(self.tokenizer_class)
+        self.index_commands(parser.parse_s(script))
 
+    def index_commands(self, commands):
         for command in commands:
             self.index_command(command)
 
     def index_command(self, command):
         directive = self.find_directive(command.directive)
-        files = command.directive_params
 
         directive_copy = directive.__class__()
         procedure_copy = None
 
+        if isinstance(directive_copy, IterativeDirective):
+            directive_copy.streaming = self.streaming
+
         sub_extract = None
 
         if command.procedure:
@@ -74,30 +212,67 @@ class FSDirector(object):
 
             sub_extract = Extract(procedure.keyword(), args)
 
-        extract = Extract(directive.keyword(), files, sub_extract)
+        extract = Extract(directive.keyword(), command.directive_params,
+                          sub_extract, command.line)
 
         self.cache.append((directive_copy, procedure_copy, extract))
 
+    def expand_paths(self, tokens):
+        """
+        :param tokens:      file paths, some of them may be patterns.
+        :return:            the paths, with each pattern replaced by the files
+                            it matches.
+        """
+        files = []
+
+        for token in tokens:
+            files.extend(self.dir_index.expand(token))
+
+        return files
+
+    def reset(self):
+        """
+        Forgets the loaded script, so another one (or the same one again) can
+        be loaded. Plugins and options are kept.
+        """
+        self.cache = []
+        self.validated = 0
+        self.dummy_fs.state.clear()
+        self.dummy_fs.stat_cache.revalidate()
+        self.dir_index = DirectoryIndex(self.dummy_fs.state)
+
     def validate(self):
         """
         Validates every step to be taken.
 
         :return:
         """
-        for directive, procedure, extract in self.cache:
-            if not directive.validate(self.dummy_fs, extract, procedure):
-                raise ValueError(
-                    "[%d] Directive %s cannot take the values: %s (%s)" %
-                    (extract.line, directive.keyword(), str(extract.tokens),
-                    extract.error)
-                )
-
-            if procedure:
-                self.validate_procedure(procedure, directive,
-                        extract.sub_extract)
+        while self.validated < len(self.cache):
+            self.validate_command(*self.cache[self.validated])
+            self.validated += 1
 
         return True
 
+    def validate_command(self, directive, procedure, extract):
+        self._run_phase("validate", extract, self._validate_command,
+                        directive, procedure, extract)
+
+    def _validate_command(self, directive, procedure, extract):
+        # patterns match the files as left by the commands validated before.
+        if directive.expands_patterns():
+            extract.tokens = self.expand_paths(extract.tokens)
+
+        if not directive.validate(self.dummy_fs, extract, procedure):
+            raise ValueError(
+                "[%d] Directive %s cannot take the values: %s (%s)" %
+                (extract.line, directive.keyword(), str(extract.tokens),
+                extract.error)
+            )
+
+        if procedure:
+            self.validate_procedure(procedure, directive,
+                    extract.sub_extract)
+
     def validate_procedure(self, procedure, directive, extract):
         if not procedure.is_applicable_to_directive(directive):
             raise ValueError(
@@ -118,23 +293,165 @@ class FSDirector(object):
         """
         Run the director as a sandbox test.
         """
-        self.begin_sandbox_dir()
+        self.dummy_fs.end_sandbox()
+
+        if self.memory_sandbox:
+            self.dummy_fs.begin_sandbox(self.sandbox_dir,
+                                        MemoryBackend(self.memory_cap))
+        else:
+            reused = self.begin_sandbox_dir()
+            self.dummy_fs.begin_sandbox(self.sandbox_dir)
+
+            if reused:
+                self.dummy_fs.mark_stale(
+                    self.dummy_fs.backend.paths(self.sandbox_dir))
 
-        self.dummy_fs.begin_sandbox(self.sandbox_dir)
+        if self.cache_dir and not self.result_cache:
+            self.result_cache = ResultCache(self.cache_dir)
 
-        for directive, procedure, extract in self.cache:
-            directive.begin(self.dummy_fs, extract)
+        steps = self.plan()
+        paths = [step.paths(self.dummy_fs.state.abspath) for step in steps]
 
-            if procedure:
-                self._run_procedure(directive, procedure, extract)
+        if any(self._can_run_files(step) for step in steps):
+            # forked before any thread of the run starts, so no lock held by
+            # one of them is copied into the workers.
+            self.pool = multiprocessing.Pool(self.processes)
 
-            directive.end(self.dummy_fs, extract)
+        if self.io_threads:
+            self.dummy_fs.prefetcher = Prefetcher(self.io_threads,
+                                                  self.prefetch_bytes)
+            self.dummy_fs.prefetcher.prefetch(self.prefetch_paths(steps))
+
+        try:
+            Scheduler(self.jobs).run(steps, paths, self.run_step)
+        finally:
+            if self.dummy_fs.prefetcher:
+                self.dummy_fs.prefetcher.close()
+                self.dummy_fs.prefetcher = None
+
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+        self.dummy_fs.drop_stale()
+
+        if self.result_cache:
+            self.result_cache.save()
+
+        if not self.memory_sandbox:
+            # the sandbox may be applied later by another process.
+            self.dummy_fs.state.save(self.changes_path())
 
         # TODO: just for development stages.
         # self.stop_sandbox_dir()
 
         self.post_process()
 
+    def plan(self):
+        """
+        :return:    the cached commands grouped into steps.
+        """
+        return plan(self.cache, self.fuse)
+
+    def prefetch_paths(self, steps):
+        """
+        :return:    the original files read by the steps, in the order they
+                    are first needed. Files the sandbox already holds are
+                    left out.
+        """
+        paths = []
+        seen = set()
+
+        for step in steps:
+            if not step.directive.reads_content():
+                continue
+
+            for file_path in step.extract.tokens:
+                abs_path = self.dummy_fs.state.abspath(file_path)
+
+                if abs_path in seen or self.dummy_fs.state.status(abs_path):
+                    continue
+
+                seen.add(abs_path)
+                paths.append(abs_path)
+
+        return paths
+
+    def run_step(self, step):
+        if not self.result_cache or not step.is_cacheable():
+            self._run_step(step)
+            return
+
+        key = self.result_cache.key(step, self.dummy_fs)
+
+        if not self.result_cache.restore(key, self.dummy_fs):
+            self._run_step(step)
+            self.result_cache.store(key, step, self.dummy_fs)
+
+    def _run_step(self, step):
+        directive = step.directive
+
+        if self.pool and self._can_run_files(step):
+            procedure, extract = step.commands[0]
+            self._run_phase("run", extract, procedure.run_files, self.dummy_fs,
+                            extract.tokens, extract.sub_extract, self.pool)
+            return
+
+        try:
+            self._run_phase("begin", step.extract, directive.begin,
+                            self.dummy_fs, step.extract)
+
+            for index, (procedure, extract) in enumerate(step.commands):
+                if procedure:
+                    if index:
+                        directive.rewind()
+
+                    self._run_phase("run", extract, self._run_procedure,
+                                    directive, procedure, extract)
+
+            self._run_phase("end", step.extract, directive.end,
+                            self.dummy_fs, step.extract)
+        finally:
+            directive.release()
+
+    def _run_phase(self, phase, extract, function, *args):
+        """
+        Calls the function between the hooks of the phase, if there are any.
+        """
+        if not self.hooks:
+            return function(*args)
+
+        self._call_hooks("before", phase, extract)
+
+        try:
+            return function(*args)
+        finally:
+            self._call_hooks("after", phase, extract)
+
+    def _call_hooks(self, method, phase, extract):
+        hooks = self.hooks if method == "before" else reversed(self.hooks)
+
+        for hook in hooks:
+            getattr(hook, method)(phase, extract)
+
+    def _can_run_files(self, step):
+        """
+        A step is sent to the process pool when it's a single command over
+        enough files, whose procedure can do the job by itself.
+        """
+        if self.processes <= 1 or len(step.commands) != 1:
+            return False
+
+        procedure, extract = step.commands[0]
+
+        # the same file twice would be written by two processes at once.
+        return procedure is not None and \
+            len(extract.tokens) >= self.pool_min_files and \
+            len(set(extract.tokens)) == len(extract.tokens) and \
+            self.dummy_fs.is_on_disk() and \
+            procedure.can_run_files(step.directive)
+
     def _run_procedure(self, directive, procedure, extract):
         if directive.repeat_each_file():
             for _ in extract.tokens:
@@ -143,6 +460,26 @@ class FSDirector(object):
         else:
             procedure.run(self.dummy_fs, directive, extract.sub_extract)
 
+    @property
+    def directives(self):
+        """
+        The directives registered, as the list they used to be kept in. Every
+        one of them is imported.
+        """
+        return self._plugins("directive")
+
+    @property
+    def procedures(self):
+        """
+        The procedures registered, as the list they used to be kept in. Every
+        one of them is imported.
+        """
+        return self._plugins("procedure")
+
+    def _plugins(self, kind):
+        return [self.registry.get(kind, keyword)
+                for keyword in self.registry.keywords(kind)]
+
     def find_directive(self, keyword):
         """
         Finds the directive that matches the name of the extract given.
@@ -152,13 +489,14 @@ class FSDirector(object):
         :param keyword:     the keyword to match.
         :return:            the directive.
         """
-        for directive in self.directives:
-            if directive.keyword() == keyword:
-                return directive
+        directive = self.registry.get("directive", keyword)
 
-        raise ValueError(
-            "Not a valid directive: %s" % keyword
-        )
+        if directive is None:
+            raise ValueError(
+                "Not a valid directive: %s" % keyword
+            )
+
+        return directive
 
     def find_procedure(self, keyword):
         """
@@ -169,13 +507,14 @@ class FSDirector(object):
         :param keyword:     the keyword to match.
         :return:            the procedure.
         """
-        for procedure in self.procedures:
-            if procedure.keyword() == keyword:
-                return procedure
+        procedure = self.registry.get("procedure", keyword)
 
-        raise ValueError(
-            "Not a valid procedure: %s" % keyword
-        )
+        if procedure is None:
+            raise ValueError(
+                "Not a valid procedure: %s" % keyword
+            )
+
+        return procedure
 
     def load_procedure(self, procedure):
         """
@@ -184,7 +523,8 @@ class FSDirector(object):
         :param procedure:       the procedure to load.
         :return:
         """
-        self.procedures.append(procedure())
+        instance = procedure()
+        self.registry.register("procedure", instance.keyword(), instance)
 
     def load_directive(self, directive):
         """
@@ -193,29 +533,93 @@ class FSDirector(object):
         :param directive:       the directive to load.
         :return:
         """
-        self.directives.append(directive())
+        instance = directive()
+        self.registry.register("directive", instance.keyword(), instance)
+
+    def load_plugins(self, manifest_path=BUILTIN_MANIFEST,
+                     entry_points=False):
+        """
+        Registers the plugins of a manifest, and optionally the ones declared
+        as entry points, without importing any of them until a script uses
+        its keyword.
+
+        :param manifest_path:   the manifest, the built-in plugins by default.
+        :param entry_points:    also look for plugins in installed packages.
+        :return:
+        """
+        self.registry.load_manifest(manifest_path)
+
+        if entry_points:
+            self.registry.load_entry_points()
 
     def begin_sandbox_dir(self):
         """
         Prepares the sandbox directory.
+
+        :return:    True if the files of the previous run are kept.
         """
-        if os.path.exists(self.sandbox_dir):
-            shutil.rmtree(self.sandbox_dir)
+        if self.reuse_sandbox and os.path.isdir(self.sandbox_dir):
+            if os.path.exists(self.changes_path()):
+                os.remove(self.changes_path())
+
+            return True
+
+        self.end_sandbox_dir()
 
         os.mkdir(self.sandbox_dir)
+        return False
 
     def end_sandbox_dir(self):
         if os.path.exists(self.sandbox_dir):
             shutil.rmtree(self.sandbox_dir)
 
+        if os.path.exists(self.changes_path()):
+            os.remove(self.changes_path())
+
+    def changes_path(self):
+        """
+        :return:    the file keeping the changes of the sandbox directory,
+                    next to it.
+        """
+        return os.path.normpath(self.sandbox_dir) + ".changes"
+
     def apply(self, keep=False):
-        if not os.path.exists(self.sandbox_dir):
+        """
+        Writes every change made in the sandbox to the file system.
+
+        :param keep:    keep the sandbox after applying it.
+        :return:        the list of paths changed.
+        """
+        if self.memory_sandbox:
+            if not self.dummy_fs.is_sandbox():
+                raise AssertionError(
+                    "Sandbox is not loaded, call sandbox_run() first."
+                )
+        elif not os.path.exists(self.sandbox_dir):
             raise AssertionError(
                 "Sandbox directory does not exists, call sandbox_run() first."
             )
 
+        if not self.dummy_fs.is_sandbox():
+            # the sandbox was run by another process, which saved its changes.
+            if not os.path.isfile(self.changes_path()):
+                raise AssertionError(
+                    "The changes of the sandbox were not saved in %s, run the "
+                    "script again before applying it." % self.changes_path()
+                )
+
+            self.dummy_fs.state.load(self.changes_path())
+            self.dummy_fs.begin_sandbox(self.sandbox_dir)
+
+        changed = Applier(self.dummy_fs, self.sandbox_dir).apply()
+
         if not keep:
-            self.end_sandbox_dir()
+            self.dummy_fs.end_sandbox()
+
+            if not self.memory_sandbox:
+                self.end_sandbox_dir()
+
+        return changed
 
     def load_argv(self):
         argscontrol.config_argv(self)
@@ -225,4 +629,10 @@ class FSDirector(object):
             self.display_sandbox()
 
     def display_sandbox(self):
-        util.treedisplay.display(self.sandbox_dir)
+        if self.memory_sandbox:
+            util.treedisplay.display_paths(
+                self.sandbox_dir,
+                self.dummy_fs.backend.paths(self.sandbox_dir)
+            )
+        else:
+            util.treedisplay.display(self.sandbox_dir)
@@ -0,0 +1,243 @@
+import hashlib
+import marshal
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from fsdir.util.atomicfile import AtomicFile
+
+
+class ResultCache(object):
+    """
+    Persistent cache of the files produced by each step. A step is keyed by
+    its directive, procedures, tokens and the content of its input files, so
+    a step whose key was seen before gets its output files restored instead of
+    being run again.
+
+    Contents are stored once by their hash in the objects directory, the
+    index maps each key to the time it was last used and the (path, content
+    hash, mode) of its outputs. The directory may be shared by many scripts,
+    so keys are only evicted, least recently used first, when there are more
+    than max_entries of them.
+    """
+
+    VERSION = 2
+
+    def __init__(self, cache_dir, max_entries=10000):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.index_path = os.path.join(cache_dir, "index")
+        self.max_entries = max_entries
+
+        # key -> (last used, outputs).
+        self.index = {}
+
+        # key -> outputs, of the keys used since the last save.
+        self.used = {}
+
+        self.hits = 0
+        self.misses = 0
+
+        # restored files a previous run had already left in the sandbox.
+        self.kept = 0
+
+        self._lock = threading.Lock()
+
+        self.load()
+
+    def load(self):
+        if not os.path.isdir(self.objects_dir):
+            os.makedirs(self.objects_dir)
+
+        self.index = self._read_index()
+
+    def _read_index(self):
+        if not os.path.isfile(self.index_path):
+            return {}
+
+        with open(self.index_path, "rb") as source:
+            try:
+                version, index = marshal.load(source)
+            except (EOFError, ValueError, TypeError):
+                return {}
+
+        if version != self.VERSION:
+            return {}
+
+        return index
+
+    def save(self):
+        """
+        Writes the index, with the keys other runs saved meanwhile, and drops
+        the contents of the evicted keys nobody references anymore.
+        """
+        now = time.time()
+        index = self._read_index()
+
+        for key, entry in self.index.iteritems():
+            if key not in index or index[key][0] < entry[0]:
+                index[key] = entry
+
+        # contents that may not be referenced anymore.
+        candidates = set()
+
+        for key, outputs in self.used.iteritems():
+            if key in index:
+                candidates.update(self._hashes(index[key][1]))
+
+            index[key] = (now, outputs)
+
+        if len(index) > self.max_entries:
+            keys = sorted(index, key=lambda key: index[key][0], reverse=True)
+
+            for key in keys[self.max_entries:]:
+                candidates.update(self._hashes(index.pop(key)[1]))
+
+        with AtomicFile(self.index_path) as target:
+            marshal.dump((self.VERSION, index), target.file)
+
+        referenced = set()
+
+        for _, outputs in index.itervalues():
+            referenced.update(self._hashes(outputs))
+
+        for content_hash in candidates - referenced:
+            object_path = os.path.join(self.objects_dir, content_hash)
+
+            if os.path.exists(object_path):
+                os.remove(object_path)
+
+        self.index = index
+        self.used = {}
+
+    @staticmethod
+    def _hashes(outputs):
+        return [content_hash for _, content_hash, _ in outputs]
+
+    def key(self, step, dummy_fs):
+        """
+        :return:    the key of the step given the current state of its files.
+        """
+        parts = [str(self.VERSION), step.directive.keyword(),
+                 repr(step.extract.tokens)]
+
+        for procedure, extract in step.commands:
+            if procedure:
+                parts.append(procedure.keyword())
+                parts.append(repr(extract.sub_extract.tokens))
+
+        for file_path in step.extract.tokens:
+            parts.append(self.hash_input(dummy_fs, file_path))
+
+        return hashlib.sha1("\0".join(parts)).hexdigest()
+
+    @staticmethod
+    def hash_input(dummy_fs, file_path):
+        if not dummy_fs.has_content(file_path):
+            return "-"
+
+        digest = hashlib.sha1()
+
+        with dummy_fs.open_file(file_path, "rb") as source:
+            for block in iter(lambda: source.read(1 << 20), ""):
+                digest.update(block)
+
+        return "%s:%r" % (digest.hexdigest(), dummy_fs.get_mode(file_path))
+
+    def restore(self, key, dummy_fs):
+        """
+        Puts the outputs stored for the key into the sandbox.
+
+        :return:    False if the key is unknown.
+        """
+        with self._lock:
+            entry = self.index.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return False
+
+            outputs = entry[1]
+            self.hits += 1
+            self.used[key] = outputs
+
+        for file_path, content_hash, mode in outputs:
+            if self._keep_stale(dummy_fs, file_path, content_hash):
+                continue
+
+            object_path = os.path.join(self.objects_dir, content_hash)
+
+            with open(object_path, "rb") as source:
+                with dummy_fs.open_output(file_path) as target:
+                    shutil.copyfileobj(source, target)
+
+            if mode is not None:
+                dummy_fs.chmod(file_path, mode)
+
+        return True
+
+    def _keep_stale(self, dummy_fs, file_path, content_hash):
+        """
+        Keeps the file a previous run left in the sandbox if it already holds
+        the content, instead of writing it again.
+
+        :return:    True if kept.
+        """
+        if not dummy_fs.is_stale(file_path):
+            return False
+
+        digest = hashlib.sha1()
+        canonical_path = dummy_fs.get_canonical_path(file_path)
+
+        with dummy_fs.backend.open(canonical_path, "rb") as source:
+            for block in iter(lambda: source.read(1 << 20), ""):
+                digest.update(block)
+
+        if digest.hexdigest() != content_hash:
+            return False
+
+        dummy_fs.keep_stale(file_path)
+
+        with self._lock:
+            self.kept += 1
+
+        return True
+
+    def store(self, key, step, dummy_fs):
+        """
+        Saves the current content of the outputs of the step.
+        """
+        outputs = []
+
+        for file_path in step.extract.tokens:
+            outputs.append((file_path, self._store_content(dummy_fs, file_path),
+                            dummy_fs.get_mode(file_path)))
+
+        with self._lock:
+            self.used[key] = outputs
+
+    def _store_content(self, dummy_fs, file_path):
+        """
+        Copies the current content of a file into the objects directory.
+
+        :return:    the hash of the content.
+        """
+        digest = hashlib.sha1()
+        fd, temp_path = tempfile.mkstemp(dir=self.objects_dir, prefix=".")
+
+        try:
+            with os.fdopen(fd, "wb") as target:
+                with dummy_fs.open_file(file_path, "rb") as source:
+                    for block in iter(lambda: source.read(1 << 20), ""):
+                        digest.update(block)
+                        target.write(block)
+
+            content_hash = digest.hexdigest()
+            os.rename(temp_path, os.path.join(self.objects_dir, content_hash))
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+        return content_hash
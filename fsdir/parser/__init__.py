@@ -1 +1,2 @@
 from fsdirparser import FSDirParser
+import compiled
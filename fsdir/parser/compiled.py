@@ -0,0 +1,82 @@
+import hashlib
+import marshal
+import os
+
+from fsdir.parser.fsdirparser import Command
+from fsdir.util.atomicfile import AtomicFile
+
+# bump whenever the parser output or this format changes.
+VERSION = 2
+
+EXTENSION = ".fsdirc"
+
+
+def script_hash(script):
+    return hashlib.sha1(script).hexdigest()
+
+
+def compiled_path(file_path, cache_dir=None):
+    """
+    :param file_path:   the path of the script.
+    :param cache_dir:   directory for compiled scripts, None to keep them next
+                        to the script.
+    :return:            where the compiled form of the script goes.
+    """
+    if cache_dir is None:
+        return os.path.splitext(file_path)[0] + EXTENSION
+
+    name = hashlib.sha1(os.path.abspath(file_path)).hexdigest()
+    return os.path.join(cache_dir, name + EXTENSION)
+
+
+def dump(commands, path, digest):
+    """
+    Writes the commands in compiled form.
+
+    :param commands:    the parsed commands.
+    :param path:        the compiled file.
+    :param digest:      hash of the script source.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    data = [(command.directive, command.directive_params, command.procedure,
+             command.procedure_params, command.line) for command in commands]
+
+    with AtomicFile(path) as target:
+        marshal.dump((VERSION, digest, data), target.file)
+
+
+def load(path, digest):
+    """
+    Reads a compiled script.
+
+    :param path:        the compiled file.
+    :param digest:      hash of the current script source.
+    :return:            the commands, None if missing, outdated or invalid.
+    """
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "rb") as source:
+        try:
+            version, compiled_digest, data = marshal.load(source)
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    if version != VERSION or compiled_digest != digest:
+        return None
+
+    commands = []
+
+    for directive, directive_params, procedure, procedure_params, line in data:
+        command = Command()
+        command.line = line
+        command.directive = directive
+        command.directive_params = directive_params
+        command.procedure = procedure
+        command.procedure_params = procedure_params
+        commands.append(command)
+
+    return commands
@@ -12,14 +12,19 @@ class ElementParser(object):
     TYPE_END_COMMAND = 5
     TYPE_IGNORE = -1
 
-    def __init__(self, tokens):
+    def __init__(self, tokens, in_command=False):
+        """
+        :param tokens:      the tokens to parse.
+        :param in_command:  whether the tokens continue a command, when
+                            parsing a source in pieces.
+        """
         self.tokens = tokens
 
         self.elements = []
         self.cursor = 0
 
         # state.
-        self.in_command = False
+        self.in_command = in_command
 
         self.process()
 
@@ -1,4 +1,7 @@
+import re
+
 from fsdir.parser.tokenizer import Tokenizer
+from fsdir.parser.regextokenizer import RegexTokenizer
 from fsdir.parser.elements import ElementParser
 
 
@@ -12,6 +15,9 @@ class Command(object):
         self.directive = None
         self.procedure = None
 
+        # line of the script where the command starts.
+        self.line = 0
+
         self.directive_params = []
         self.procedure_params = []
 
@@ -31,7 +37,25 @@ class Command(object):
 
 
 class FSDirParser(object):
-    def __init__(self):
+    # a piece of source with every quote, parenthesis and brace closed.
+    CLOSED = re.compile(r"""
+        (?:
+            '[^']*'
+            | \([^)]*\)
+            | \{[^}]*\}
+            | \#[^\n]*
+            | [^'({\#]
+        )*
+        \Z
+    """, re.VERBOSE)
+
+    def __init__(self, tokenizer_class=RegexTokenizer):
+        """
+        :param tokenizer_class:     the tokenizer to use, RegexTokenizer or the
+                                    character by character Tokenizer.
+        """
+        self.tokenizer_class = tokenizer_class
+
         self.tokens = None
         self.source = None
         self.elements = None
@@ -39,11 +63,16 @@ class FSDirParser(object):
         self.command = None
         self.commands = []
 
+        # line of the first character of the source being indexed.
+        self.line = 1
+        self._line_position = 0
+        self._in_command = False
+
     def parse_s(self, source):
         self.source = source
 
         # get parsed tokens.
-        tokenizer = Tokenizer(source)
+        tokenizer = self.tokenizer_class(source)
         self.tokens = tokenizer.tokens
 
         # get parsed elements.
@@ -51,19 +80,91 @@ class FSDirParser(object):
         self.elements = element_parser.elements
 
         # index each element into commands.
+        self.command = Command()
+        self.line = 1
+        self._line_position = 0
         self.index_elements()
 
         return self.commands
 
-    def index_elements(self):
-        # create the current command.
+    def iter_parse(self, source_file):
+        """
+        Parses a script from a file object, yielding each command as soon as
+        its lines are read. Only the lines of the current command are kept.
+
+        :param source_file:     file object, or any iterable of lines.
+        """
         self.command = Command()
+        self._in_command = False
+
+        # complete piece of source waiting to be parsed, and its first line.
+        ready = None
+        ready_line = 1
+
+        chunk = []
+        line = 1
+
+        for number, text in enumerate(source_file, 1):
+            if ready is not None and not chunk and \
+                    text == Tokenizer.CHAR_NEWLINE:
+                # consecutive line breaks make a single token, keep them
+                # together.
+                ready += text
+                continue
+
+            if not chunk:
+                line = number
+
+            chunk.append(text)
+
+            if not text.endswith(Tokenizer.CHAR_NEWLINE):
+                continue
+
+            source = "".join(chunk)
+
+            if not self.CLOSED.match(source):
+                # a parameter spans more lines.
+                continue
+
+            chunk = []
 
+            if ready is not None:
+                for command in self._parse_chunk(ready, ready_line):
+                    yield command
+
+            ready = source
+            ready_line = line
+
+        if ready is not None:
+            for command in self._parse_chunk(ready, ready_line):
+                yield command
+
+        if chunk:
+            for command in self._parse_chunk("".join(chunk), line):
+                yield command
+
+    def _parse_chunk(self, source, line):
+        self.source = source
+        self.tokens = self.tokenizer_class(source).tokens
+
+        element_parser = ElementParser(self.tokens, self._in_command)
+        self.elements = element_parser.elements
+        self._in_command = element_parser.in_command
+
+        self.commands = []
+        self.line = line
+        self._line_position = 0
+        self.index_elements()
+
+        return self.commands
+
+    def index_elements(self):
         # for each element in the elements try to fill the command with
         # instructions.
         for element in self.elements:
             if element.type == ElementParser.TYPE_DIRECTIVE:
                 self.command.directive = self.identifier_substring(element)
+                self.command.line = self.line_of(element)
             elif element.type == ElementParser.TYPE_DIRECTIVE_PARAMS:
                 self.command.directive_params = self.identifier_params(element)
             elif element.type == ElementParser.TYPE_PROCEDURE:
@@ -76,6 +177,18 @@ class FSDirParser(object):
                 # and create a new one to start again.
                 self.command = Command()
 
+    def line_of(self, data):
+        """
+        Line number of an element, elements are expected in source order.
+        """
+        position = self.tokens[data.position].position
+
+        self.line += self.source.count(Tokenizer.CHAR_NEWLINE,
+                                       self._line_position, position)
+        self._line_position = position
+
+        return self.line
+
     def identifier_substring(self, data):
         token = self.tokens[data.position]
 
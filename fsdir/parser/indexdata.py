@@ -1,8 +1,15 @@
-class Index(object):
-    def __init__(self, position=0, length=0, type=0):
-        self.position = position
-        self.length = length
-        self.type = type
+from collections import namedtuple
+
+
+class Index(namedtuple('Index', 'position length type')):
+    """
+    Immutable token location, a tuple so that tokenizers can build it without
+    running any Python code.
+    """
+    __slots__ = ()
+
+    def __new__(cls, position=0, length=0, type=0):
+        return tuple.__new__(cls, (position, length, type))
 
 
 class IndexData(object):
@@ -0,0 +1,95 @@
+import re
+
+from fsdir.parser.indexdata import Index
+from fsdir.parser.tokenizer import Tokenizer
+
+
+class RegexTokenizer(object):
+    """
+    Same tokens as Tokenizer, found with a single master regular expression
+    instead of walking the source one character at a time.
+    """
+
+    # blank space before a token is part of its match, so there's a single
+    # match per token. Group numbers are used to tell the token type.
+    PATTERN = re.compile(r"""
+        [ \t]*
+        (?:
+            ([A-Z]+)
+            | '([^']*)'?
+            | \(([^)]*)\)?
+            | \{([^}]*)\}?
+            | (\#[^\n]*)\n?
+            | (\n+)
+            | $
+        )
+    """, re.VERBOSE)
+
+    GROUP_TEXT_PARAMETER = 4
+
+    # token type of each group.
+    TYPES = (
+        None,
+        Tokenizer.TYPE_IDENTIFIER,
+        Tokenizer.TYPE_FILE_PATH,
+        Tokenizer.TYPE_PARAMETER,
+        Tokenizer.TYPE_TEXT_PARAMETER,
+        Tokenizer.TYPE_COMMENT,
+        Tokenizer.TYPE_NEWLINE,
+    )
+
+    def __init__(self, source):
+        self.source = source
+        self.tokens = []
+
+        self.process()
+
+    def process(self):
+        source = self.source
+        append = self.tokens.append
+        new_index = tuple.__new__
+        types = self.TYPES
+        text_group = self.GROUP_TEXT_PARAMETER
+        position = 0
+
+        # the scanner only matches right where the previous match ended.
+        for match in iter(self.PATTERN.scanner(source).match, None):
+            position = match.end()
+            group = match.lastindex
+
+            if group is None:
+                # trailing blank space.
+                if position == len(source):
+                    break
+
+                continue
+
+            if group == text_group:
+                append(self.text_param(match))
+            else:
+                start, stop = match.span(group)
+                append(new_index(Index, (start, stop - start, types[group])))
+
+        if position < len(source):
+            raise ValueError("Wrong syntax: " + source[position:])
+
+    def text_param(self, match):
+        """
+        Text parameters drop the line break after the opening brace and the
+        one before the closing brace, as Tokenizer.parse_text_param does.
+        """
+        start = match.start(self.GROUP_TEXT_PARAMETER) - 1
+        stop = match.end(self.GROUP_TEXT_PARAMETER)
+
+        offset_start = 1
+        length = stop - start - 1
+
+        if self.source[stop + 1] == Tokenizer.CHAR_NEWLINE:
+            offset_start += 1
+            length -= 1
+
+        if self.source[stop - 1] == Tokenizer.CHAR_NEWLINE:
+            length -= 1
+
+        return Index(start + offset_start, length,
+                     Tokenizer.TYPE_TEXT_PARAMETER)
@@ -0,0 +1,162 @@
+from fsdir.core import iter_lines
+
+
+class PieceTable(object):
+    """
+    Text buffer over the original content of a file, which is never changed,
+    and the texts inserted since. The content is a sequence of pieces, each
+    one a span of either of them, so an edit costs the size of the text it
+    inserts instead of a copy of the whole file.
+
+    Positions are offsets in the current content.
+    """
+
+    # bytes read at once when iterating or writing the content.
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, original=""):
+        """
+        :param original:    the original content, a string or a read-only
+                            buffer such as an mmap.
+        """
+        self.original = original
+
+        # (buffer, start, end) spans, in order.
+        self.pieces = []
+        self.length = len(original)
+
+        if self.length:
+            self.pieces.append((original, 0, self.length))
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        """
+        Iterates over the lines of the content, the same way iterating over a
+        file does. The content is read a chunk at a time.
+        """
+        return iter_lines(self.iter_chunks(self.CHUNK_SIZE))
+
+    def iter_chunks(self, size=None):
+        """
+        :param size:    maximum size of each chunk, pieces are split if bigger.
+        """
+        for buf, start, end in self.pieces:
+            if not size:
+                yield buf[start:end]
+                continue
+
+            for position in xrange(start, end, size):
+                yield buf[position:min(position + size, end)]
+
+    def iter_spans(self):
+        """
+        :return:    (offset, line) for each line of the content.
+        """
+        offset = 0
+
+        for line in self:
+            yield offset, line
+            offset += len(line)
+
+    def is_original(self):
+        if not self.pieces:
+            return not len(self.original)
+
+        return len(self.pieces) == 1 and self.pieces[0][0] is self.original \
+            and self.pieces[0][1:] == (0, len(self.original))
+
+    def content(self):
+        """
+        :return:    the whole content, the original buffer itself while it's
+                    not edited.
+        """
+        if self.is_original():
+            return self.original
+
+        return ''.join(self.iter_chunks())
+
+    def append(self, text):
+        if text:
+            self.pieces.append((text, 0, len(text)))
+            self.length += len(text)
+
+    def set(self, text):
+        """
+        Replaces the whole content.
+        """
+        self.pieces = [(text, 0, len(text))] if text else []
+        self.length = len(text)
+
+    def splice(self, edits):
+        """
+        Applies many edits in a single pass over the pieces.
+
+        :param edits:   (start, end, text) tuples, sorted and not overlapping,
+                        replacing the span from start to end by the text.
+        """
+        pieces = []
+        edits = iter(edits)
+        edit = next(edits, None)
+
+        # content before this offset is removed.
+        skip_until = 0
+        offset = 0
+
+        for buf, start, end in self.pieces:
+            piece_end = offset + end - start
+            position = offset
+
+            while True:
+                if position < skip_until:
+                    position = min(skip_until, piece_end)
+
+                if edit is None or edit[0] >= piece_end:
+                    break
+
+                edit_start, edit_end, text = edit
+
+                if edit_start > position:
+                    pieces.append((buf, start + position - offset,
+                                   start + edit_start - offset))
+
+                if text:
+                    pieces.append((text, 0, len(text)))
+
+                position = edit_start
+                skip_until = edit_end
+                edit = next(edits, None)
+
+            if position < piece_end:
+                pieces.append((buf, start + position - offset, end))
+
+            offset = piece_end
+
+        # insertions at the end of the content.
+        while edit is not None:
+            if edit[0] != offset:
+                raise ValueError("Edit out of the content: %d to %d" %
+                                 edit[:2])
+
+            if edit[2]:
+                pieces.append((edit[2], 0, len(edit[2])))
+
+            edit = next(edits, None)
+
+        self.pieces = pieces
+        self.length = sum(end - start for _, start, end in pieces)
+
+    def write_to(self, target):
+        for chunk in self.iter_chunks(self.CHUNK_SIZE):
+            target.write(chunk)
+
+    def close(self):
+        """
+        Releases the original buffer, the table can't be read anymore.
+        """
+        if hasattr(self.original, 'close'):
+            self.original.close()
+
+        self.pieces = []
+        self.length = 0
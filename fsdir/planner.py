@@ -0,0 +1,75 @@
+class Step(object):
+    """
+    A directive that begins and ends once, with every procedure that has to run
+    in between. Each procedure keeps the extract of its own command.
+    """
+
+    def __init__(self, directive, extract):
+        self.directive = directive
+        self.extract = extract
+
+        # (procedure, extract) pairs, in script order.
+        self.commands = []
+
+    def add_command(self, procedure, extract):
+        self.commands.append((procedure, extract))
+
+    def paths(self, abspath):
+        """
+        :param abspath:     callable converting a path to an absolute one.
+        :return:            the set of every file this step may touch.
+        """
+        paths = set(abspath(file_path) for file_path in self.extract.tokens)
+
+        for procedure, extract in self.commands:
+            if procedure:
+                for file_path in procedure.get_paths(extract.sub_extract):
+                    paths.add(abspath(file_path))
+
+        return paths
+
+    def is_cacheable(self):
+        """
+        The result of a step can be cached when it only changes the files of
+        its directive.
+        """
+        if not self.directive.is_cacheable():
+            return False
+
+        for procedure, extract in self.commands:
+            if procedure and procedure.get_paths(extract.sub_extract):
+                return False
+
+        return True
+
+    def can_fuse(self, directive, extract):
+        """
+        A command can join this step if it's the same fusable directive over
+        exactly the same files.
+        """
+        return self.directive.is_fusable() and \
+            directive.__class__ == self.directive.__class__ and \
+            extract.tokens == self.extract.tokens
+
+
+def plan(cache, fuse=True):
+    """
+    Groups the cached commands into steps. Adjacent commands that can share
+    their directive are fused, so the files are read and written once.
+
+    :param cache:   list of (directive, procedure, extract) tuples.
+    :param fuse:    False to get one step per command.
+    :return:        list of steps.
+    """
+    steps = []
+
+    for directive, procedure, extract in cache:
+        if fuse and steps and steps[-1].can_fuse(directive, extract):
+            steps[-1].add_command(procedure, extract)
+            continue
+
+        step = Step(directive, extract)
+        step.add_command(procedure, extract)
+        steps.append(step)
+
+    return steps
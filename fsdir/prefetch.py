@@ -0,0 +1,150 @@
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+# states of a path waiting to be read, or being read.
+_QUEUED = object()
+_READING = object()
+
+
+class Prefetcher(object):
+    """
+    Reads the original files of the upcoming commands ahead of time, on a
+    pool of threads, so on high-latency file systems many reads are in flight
+    at once instead of one after the other.
+
+    The content is kept in memory, up to a maximum amount of bytes, until the
+    command asks for it. A command asking for a file that is still queued
+    reads it by itself, one being read waits for it.
+
+    Only the original files are read ahead: no command changes them during a
+    sandbox run, so they can be read in any order. Copies into the sandbox,
+    chmods and writes depend on what the commands before did to the same
+    files; the scheduler already overlaps those of commands sharing no file
+    with --jobs.
+    """
+
+    def __init__(self, threads=8, max_bytes=64 * 1024 * 1024):
+        """
+        :param threads:     reads in flight at once.
+        :param max_bytes:   bytes kept in memory, files that don't fit are
+                            not read ahead.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        # absolute path -> _QUEUED, _READING, the content, or None if it's
+        # not going to be read ahead.
+        self.entries = {}
+
+        self.hits = 0
+        self.misses = 0
+
+        self._condition = threading.Condition()
+        self._closed = False
+        self._pool = ThreadPool(threads)
+
+    def prefetch(self, paths):
+        """
+        Queues the paths to be read, in the given order.
+        """
+        with self._condition:
+            for path in paths:
+                if path not in self.entries:
+                    self.entries[path] = _QUEUED
+                    self._pool.apply_async(self._read, (path,))
+
+    def _read(self, path):
+        with self._condition:
+            if self._closed or self.entries.get(path) is not _QUEUED:
+                return
+
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = None
+
+        with self._condition:
+            if size is None or size > self.max_bytes:
+                self.entries[path] = None
+                return
+
+            # wait for the commands to take the content read before.
+            while self.size + size > self.max_bytes and not self._closed and \
+                    self.entries.get(path) is _QUEUED:
+                self._condition.wait()
+
+            if self._closed or self.entries.get(path) is not _QUEUED:
+                return
+
+            self.entries[path] = _READING
+            self.size += size
+
+        try:
+            with open(path, "rb") as source:
+                data = source.read()
+        except IOError:
+            data = None
+
+        with self._condition:
+            self.size -= size
+
+            if self.entries.get(path) is _READING and data is not None:
+                self.entries[path] = data
+                self.size += len(data)
+            else:
+                self.entries[path] = None
+
+            self._condition.notify_all()
+
+    def take(self, path):
+        """
+        Hands over the content read ahead, which is forgotten so its bytes
+        can be used to read other files ahead.
+
+        :param path:    absolute path of the original file.
+        :return:        its content, or None if it was not read ahead.
+        """
+        with self._condition:
+            # a queued path is read now by the caller, faster than waiting
+            # for it in the queue, and the task skips it.
+            while self.entries.get(path) is _READING:
+                self._condition.wait()
+
+            data = self.entries.pop(path, None)
+
+            if data is _QUEUED or data is None:
+                self.misses += 1
+                return None
+
+            self.size -= len(data)
+            self.hits += 1
+            self._condition.notify_all()
+
+            return data
+
+    def discard(self, path):
+        """
+        Forgets the content of a file, once the sandbox has its own copy.
+        """
+        with self._condition:
+            data = self.entries.get(path)
+
+            if isinstance(data, str):
+                self.size -= len(data)
+
+            if path in self.entries:
+                self.entries[path] = None
+
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        self._pool.close()
+        self._pool.join()
+
+        self.entries = {}
+        self.size = 0
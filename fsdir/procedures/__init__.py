@@ -3,3 +3,4 @@ from copyto import CopyTo
 from replace import Replace
 from chmod import ChMod
 from set import Set
+from translate import Translate
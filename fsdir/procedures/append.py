@@ -1,5 +1,6 @@
 from fsdir.core import Procedure
 import fsdir.directives
+import itertools
 
 
 class Append(Procedure):
@@ -12,9 +13,16 @@ class Append(Procedure):
 
     def run(self, dummy_fs, directive, extract):
         lines = directive.get_current()
+        appended = []
 
         for arg in extract.tokens:
             if type(arg) == list:
-                lines.append('\n'.join(arg) + "\n")
+                appended.append('\n'.join(arg) + "\n")
             else:
-                lines.append(arg + "\n")
+                appended.append(arg + "\n")
+
+        if directive.is_streaming():
+            directive.set(directive.get_index(),
+                          itertools.chain(lines, appended))
+        else:
+            lines.append(''.join(appended))
@@ -22,3 +22,6 @@ class CopyTo(Procedure):
 
     def run(self, dummy_fs, directive, extract):
         pass
+
+    def get_paths(self, extract):
+        return extract.tokens
@@ -1,9 +1,51 @@
-from fsdir.core import Procedure
+from fsdir.backends import map_path
+from fsdir.core import Procedure, LineSource
+from fsdir.util.atomicfile import AtomicFile
 import fsdir.directives
 import re
 
+# patterns compiled by a pool worker, the pool serves every step of a run.
+_matchers = {}
+
+
+def _replace_file(task):
+    """
+    Pool task, replaces over a single file.
+
+    :param task:    (pattern, flags, replacement, buffer mode, source path,
+                    target path), the paths may be the same one.
+    """
+    pattern, flags, replacement, buffer_mode, source_path, target_path = task
+    matcher = _matchers.get((pattern, flags))
+
+    if matcher is None:
+        matcher = _matchers[(pattern, flags)] = re.compile(pattern, flags)
+
+    with AtomicFile(target_path, source_path) as target:
+        if buffer_mode:
+            buf = map_path(source_path)
+
+            try:
+                target.writelines(
+                    Replace.iter_substitute(buf, matcher, replacement))
+            finally:
+                if hasattr(buf, 'close'):
+                    buf.close()
+        else:
+            with open(source_path, "rb") as source:
+                target.writelines(
+                    Replace.iter_replace(source, matcher, replacement))
+
 
 class Replace(Procedure):
+    # flags that can be given as a third token, e.g. (ms).
+    FLAGS = {
+        'i': re.IGNORECASE,
+        'm': re.MULTILINE,
+        's': re.DOTALL,
+        'x': re.VERBOSE,
+    }
+
     def __init__(self):
         super(Replace, self).__init__()
 
@@ -17,13 +59,22 @@ class Replace(Procedure):
         Should always receive two tokens, the first one always has to be
         non-blank, while the second one could be anything. List for multi-line
         and string for single line.
+
+        An optional third token with regex flags (any of "imsx") switches to
+        buffer mode: the pattern runs over the whole file and only the matched
+        substrings are replaced, as re.sub does.
         """
-        if len(extract.tokens) != 2:
+        if len(extract.tokens) not in (2, 3):
             return False
 
         if extract.tokens[0] == '':
             return False
 
+        if len(extract.tokens) == 3:
+            for flag in extract.tokens[2]:
+                if flag not in self.FLAGS:
+                    return False
+
         return True
 
     def run(self, dummy_fs, directive, extract):
@@ -31,17 +82,137 @@ class Replace(Procedure):
         Search for all matches in the source file and replaces them.
         """
         if not self.matcher:
-            self.matcher = re.compile(extract.tokens[0])
+            self.matcher = re.compile(extract.tokens[0],
+                                      self.get_flags(extract))
 
         lines = directive.get_current()
+        replacement = extract.tokens[1]
+
+        if not directive.is_streaming():
+            if len(extract.tokens) == 3:
+                lines.splice(self.iter_matches(lines.content(), self.matcher,
+                                               replacement))
+            else:
+                self.replace_lines(lines, self.matcher, replacement)
+        elif len(extract.tokens) == 3:
+            directive.set(directive.get_index(), self.substitute(
+                dummy_fs, lines, self.matcher, replacement))
+        else:
+            directive.set(directive.get_index(), self.iter_replace(
+                lines, self.matcher, replacement))
+
+    def can_run_files(self, directive):
+        return directive.__class__ == fsdir.directives.Edit
+
+    def run_files(self, dummy_fs, file_paths, extract, pool):
+        """
+        Replaces over every file using the pool of processes of the run. Each
+        worker compiles the pattern once, tasks are sent in chunks.
+        """
+        settings = (extract.tokens[0], self.get_flags(extract),
+                    extract.tokens[1], len(extract.tokens) == 3)
+        tasks = []
+
+        for file_path in file_paths:
+            source_path = dummy_fs.source_path(file_path)
+            tasks.append(settings + (source_path,
+                                     dummy_fs.output_path(file_path)))
+
+        pool.map(_replace_file, tasks)
 
-        self.find_and_replace(lines, self.matcher, extract.tokens[1])
+    def get_flags(self, extract):
+        flags = 0
+
+        if len(extract.tokens) == 3:
+            for flag in extract.tokens[2]:
+                flags |= self.FLAGS[flag]
+
+        return flags
 
     @staticmethod
-    def find_and_replace(lines, matcher, replacement):
-        for index, line in enumerate(lines):
+    def replace_lines(table, matcher, replacement):
+        """
+        Replaces every line matching the pattern, keeping its line break. Only
+        the replaced lines are put into the piece table.
+        """
+        edits = []
+
+        for offset, line in table.iter_spans():
             if matcher.match(line):
-                lines[index] = replacement
+                if line[-1] == '\n':
+                    edits.append((offset, offset + len(line),
+                                  replacement + '\n'))
+                else:
+                    edits.append((offset, offset + len(line), replacement))
 
+        table.splice(edits)
+
+    @staticmethod
+    def iter_replace(lines, matcher, replacement):
+        """
+        Same as replace_lines, but over any iterable of lines, yielding the
+        resulting lines one by one.
+        """
+        for line in lines:
+            if matcher.match(line):
                 if line[-1] == '\n':
-                    lines[index] += '\n'
+                    yield replacement + '\n'
+                else:
+                    yield replacement
+            else:
+                yield line
+
+    @staticmethod
+    def substitute(dummy_fs, lines, matcher, replacement):
+        """
+        Runs the substitution over the whole content at once. If the lines
+        are still the untouched file, it's memory mapped instead of read.
+        """
+        if isinstance(lines, LineSource):
+            buf = dummy_fs.map_file(lines.file_path)
+        else:
+            buf = ''.join(lines)
+
+        try:
+            for chunk in Replace.iter_substitute(buf, matcher, replacement):
+                yield chunk
+        finally:
+            if hasattr(buf, 'close'):
+                buf.close()
+
+    @staticmethod
+    def iter_matches(buf, matcher, replacement):
+        """
+        Yields (start, end, expanded replacement) for each match of the
+        buffer. Follows re.sub: empty matches adjacent to a previous match are
+        not replaced.
+        """
+        last_end = -1
+
+        for match in matcher.finditer(buf):
+            start, end = match.span()
+
+            if start == end and start == last_end:
+                continue
+
+            yield start, end, match.expand(replacement)
+            last_end = end
+
+    @staticmethod
+    def iter_substitute(buf, matcher, replacement):
+        """
+        Yields the spans of the buffer between matches, and the expanded
+        replacement for each match.
+        """
+        position = 0
+
+        for start, end, text in Replace.iter_matches(buf, matcher,
+                                                     replacement):
+            if start > position:
+                yield buf[position:start]
+
+            yield text
+            position = end
+
+        if position < len(buf):
+            yield buf[position:]
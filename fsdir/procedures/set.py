@@ -22,9 +22,10 @@ class Set(Procedure):
         """
         replacement = extract.tokens[0]
 
-        index = directive.get_index()
-
         if type(replacement) == list:
-            directive.set(index, '\n'.join(replacement))
+            replacement = '\n'.join(replacement)
+
+        if directive.is_streaming():
+            directive.set(directive.get_index(), [replacement])
         else:
-            directive.set(index, replacement)
+            directive.get_current().set(replacement)
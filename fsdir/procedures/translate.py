@@ -0,0 +1,176 @@
+from fsdir.core import Procedure
+import fsdir.directives
+import re
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+class Translate(Procedure):
+    """
+    Replaces many literal strings at once, each file is scanned a single time
+    whatever the amount of strings.
+
+    The mapping is given inline, one "old => new" pair per line:
+
+        EDIT 'hosts' TRANSLATE {
+            alpha.local => alpha.example.com
+            beta.local => beta.example.com
+        }
+
+    or as the path of a file with the same lines, e.g. TRANSLATE (hosts.map).
+    Where several keys match at the same position the longest one wins.
+    """
+
+    SEPARATOR = "=>"
+
+    def __init__(self):
+        super(Translate, self).__init__()
+
+        self.mapping = None
+        self.matcher = None
+
+    def is_applicable_to_directive(self, directive):
+        return directive.__class__ == fsdir.directives.Edit
+
+    def validate(self, dummy_fs, extract):
+        """
+        Should always receive one token, the mapping lines, with at least one
+        non-blank key, or the path of the mapping file. A token with no
+        separator at all is taken as a path. Mapping files are only read when
+        running, as the commands before may change them.
+        """
+        if len(extract.tokens) != 1:
+            return False
+
+        token = extract.tokens[0]
+
+        if not self.is_inline(token):
+            return bool(token) and dummy_fs.isfile(token)
+
+        if type(token) == list:
+            lines = token
+        else:
+            lines = token.splitlines()
+
+        self.mapping = self.parse_mapping(lines)
+
+        return bool(self.mapping)
+
+    @classmethod
+    def is_inline(cls, token):
+        return type(token) == list or cls.SEPARATOR in token
+
+    def get_paths(self, extract):
+        token = extract.tokens[0]
+
+        # the mapping file is read, so it must be ready before running.
+        if self.is_inline(token):
+            return []
+
+        return [token]
+
+    def load_mapping(self, dummy_fs, file_path):
+        """
+        Reads the mapping file as left by the commands run before.
+        """
+        with dummy_fs.open_file(file_path, "rb") as source:
+            mapping = self.parse_mapping(source.read().splitlines())
+
+        if not mapping:
+            raise ValueError("Not a valid mapping file: %s" % file_path)
+
+        return mapping
+
+    def run(self, dummy_fs, directive, extract):
+        if not self.matcher:
+            if self.mapping is None:
+                self.mapping = self.load_mapping(dummy_fs, extract.tokens[0])
+
+            self.matcher = self.build_matcher(self.mapping)
+
+        lines = directive.get_current()
+
+        if directive.is_streaming():
+            directive.set(directive.get_index(),
+                          (self.matcher(line) for line in lines))
+            return
+
+        # only the translated lines are put into the table.
+        edits = []
+
+        for offset, line in lines.iter_spans():
+            translated = self.matcher(line)
+
+            if translated != line:
+                edits.append((offset, offset + len(line), translated))
+
+        lines.splice(edits)
+
+    @classmethod
+    def parse_mapping(cls, lines):
+        """
+        :param lines:   "old => new" lines, blank lines are skipped.
+        :return:        dict of old to new strings, None if a line is not a
+                        pair or has a blank key.
+        """
+        mapping = {}
+
+        for line in lines:
+            if not line.strip():
+                continue
+
+            if cls.SEPARATOR not in line:
+                return None
+
+            old, new = line.split(cls.SEPARATOR, 1)
+            old = old.strip()
+
+            if not old:
+                return None
+
+            mapping[old] = new.strip()
+
+        return mapping
+
+    @staticmethod
+    def build_matcher(mapping):
+        """
+        Builds an Aho-Corasick automaton with the keys when pyahocorasick is
+        installed, a single alternation of every key otherwise.
+
+        :return:    callable translating a line.
+        """
+        if ahocorasick and hasattr(ahocorasick.Automaton, 'iter_long'):
+            automaton = ahocorasick.Automaton()
+
+            for old, new in mapping.iteritems():
+                automaton.add_word(old, (len(old), new))
+
+            automaton.make_automaton()
+
+            def translate(line):
+                chunks = []
+                position = 0
+
+                for end, (length, new) in automaton.iter_long(line):
+                    chunks.append(line[position:end - length + 1])
+                    chunks.append(new)
+                    position = end + 1
+
+                if not chunks:
+                    return line
+
+                chunks.append(line[position:])
+                return ''.join(chunks)
+
+            return translate
+
+        # longest keys first, so they win over their prefixes.
+        keys = sorted(mapping, key=len, reverse=True)
+        matcher = re.compile('|'.join(re.escape(key) for key in keys))
+
+        return lambda line: matcher.sub(
+            lambda match: mapping[match.group(0)], line)
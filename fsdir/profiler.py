@@ -0,0 +1,186 @@
+import json
+import threading
+import time
+
+
+class CommandProfile(object):
+    """
+    What a single command of the script took.
+    """
+
+    PHASES = ("validate", "begin", "run", "end")
+
+    def __init__(self, extract):
+        self.line = extract.line
+        self.keyword = extract.keyword
+        self.tokens = extract.tokens
+
+        self.times = dict((phase, 0.0) for phase in self.PHASES)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.files = set(extract.tokens)
+
+    def total(self):
+        return sum(self.times.itervalues())
+
+    def as_dict(self):
+        return {
+            "line": self.line,
+            "command": self.keyword,
+            "tokens": self.tokens,
+            "times": self.times,
+            "total": self.total(),
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "files": sorted(self.files),
+        }
+
+
+class CountingFile(object):
+    """
+    File wrapper counting the bytes read and written through it into the
+    profile of the command that opened it.
+    """
+
+    def __init__(self, source, profile):
+        self._source = source
+        self._profile = profile
+
+    def read(self, *args):
+        data = self._source.read(*args)
+        self._profile.bytes_read += len(data)
+        return data
+
+    def readline(self, *args):
+        line = self._source.readline(*args)
+        self._profile.bytes_read += len(line)
+        return line
+
+    def __iter__(self):
+        for line in self._source:
+            self._profile.bytes_read += len(line)
+            yield line
+
+    def write(self, data):
+        self._profile.bytes_written += len(data)
+        self._source.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def __getattr__(self, name):
+        return getattr(self._source, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # outputs discard what was written when something failed.
+        return self._source.__exit__(exc_type, exc_val, exc_tb)
+
+
+class Profiler(object):
+    """
+    Director hook recording the wall time of each phase of every command,
+    with the bytes read and written, and the files touched, while the phase
+    runs. Commands fused into one step share the begin and end of the first
+    one.
+
+    Steps run by process pools only count their time, and steps restored
+    from the result cache don't count at all.
+    """
+
+    def __init__(self):
+        # id of the extract of the command -> CommandProfile.
+        self.profiles = {}
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        self.dummy_fs = None
+
+    def install(self, director):
+        director.hooks.append(self)
+        director.dummy_fs.profiler = self
+        self.dummy_fs = director.dummy_fs
+
+    def current(self):
+        """
+        :return:    the profile of the command running in this thread, None
+                    if there's none.
+        """
+        stack = getattr(self._local, "stack", None)
+
+        if stack:
+            return stack[-1][0]
+
+        return None
+
+    def before(self, phase, extract):
+        with self._lock:
+            profile = self.profiles.get(id(extract))
+
+            if profile is None:
+                profile = self.profiles[id(extract)] = CommandProfile(extract)
+
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+
+        self._local.stack.append((profile, time.time()))
+
+    def after(self, phase, extract):
+        profile, started = self._local.stack.pop()
+        profile.times[phase] += time.time() - started
+
+    def wrap(self, file_path, source):
+        """
+        :return:    the file, counting its bytes if a command is running.
+        """
+        profile = self.current()
+
+        if profile is None:
+            return source
+
+        profile.files.add(file_path)
+
+        return CountingFile(source, profile)
+
+    def count_read(self, file_path, size):
+        profile = self.current()
+
+        if profile is not None:
+            profile.files.add(file_path)
+            profile.bytes_read += size
+
+    def sorted_profiles(self):
+        return sorted(self.profiles.itervalues(),
+                      key=lambda profile: profile.total(), reverse=True)
+
+    def report(self):
+        """
+        Prints every command, the slowest first, then how well the stat cache
+        did.
+        """
+        print "%6s  %-8s %10s %10s %10s %10s %10s %10s %10s %6s" % (
+            "line", "command", "validate", "begin", "run", "end", "total",
+            "read", "written", "files")
+
+        for profile in self.sorted_profiles():
+            times = profile.times
+
+            print "%6d  %-8s %10.4f %10.4f %10.4f %10.4f %10.4f %10d %10d " \
+                  "%6d" % (profile.line, profile.keyword, times["validate"],
+                           times["begin"], times["run"], times["end"],
+                           profile.total(), profile.bytes_read,
+                           profile.bytes_written, len(profile.files))
+
+        if self.dummy_fs:
+            stat_cache = self.dummy_fs.stat_cache
+            print "stat cache: %d hits, %d misses" % (stat_cache.hits,
+                                                      stat_cache.misses)
+
+    def dump_json(self, path):
+        with open(path, "w") as target:
+            json.dump([profile.as_dict() for profile in self.sorted_profiles()],
+                      target, indent=2)
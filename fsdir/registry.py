@@ -0,0 +1,117 @@
+import importlib
+import os
+
+# manifest of the plugins shipped with fsdir.
+BUILTIN_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "plugins.manifest")
+
+# entry point groups other packages can declare plugins in.
+ENTRY_POINT_GROUPS = {
+    "directive": "fsdir.directives",
+    "procedure": "fsdir.procedures",
+}
+
+
+class PluginRegistry(object):
+    """
+    Keyword to plugin maps, one for directives and one for procedures.
+
+    Plugins can be known by the "module:Class" path of their class only, they
+    are imported and instantiated the first time their keyword is looked up,
+    so plugins a script doesn't use are never imported.
+    """
+
+    KINDS = ("directive", "procedure")
+
+    def __init__(self):
+        # kind -> keyword -> instance, or "module:Class" path if not loaded.
+        self.plugins = dict((kind, {}) for kind in self.KINDS)
+
+    def register(self, kind, keyword, plugin):
+        """
+        :param kind:        "directive" or "procedure".
+        :param keyword:     the keyword used in scripts.
+        :param plugin:      an instance, or the "module:Class" path of the
+                            class.
+        """
+        if kind not in self.plugins:
+            raise ValueError("Not a valid plugin kind: %s" % kind)
+
+        self.plugins[kind][keyword] = plugin
+
+    def get(self, kind, keyword):
+        """
+        :return:    the instance of the plugin, None if there's none with the
+                    keyword.
+        """
+        plugin = self.plugins[kind].get(keyword)
+
+        if isinstance(plugin, basestring):
+            plugin = self.plugins[kind][keyword] = self._load(plugin)
+
+        return plugin
+
+    def copy(self):
+        """
+        :return:    a registry with the same plugins, registering more in it
+                    leaves this one untouched.
+        """
+        registry = self.__class__()
+
+        for kind, plugins in self.plugins.iteritems():
+            registry.plugins[kind] = dict(plugins)
+
+        return registry
+
+    def keywords(self, kind):
+        return sorted(self.plugins[kind])
+
+    @staticmethod
+    def _load(path):
+        module_name, _, class_name = path.partition(":")
+        target = importlib.import_module(module_name)
+
+        for name in class_name.split("."):
+            target = getattr(target, name)
+
+        return target()
+
+    def load_manifest(self, manifest_path):
+        """
+        Registers the plugins of a manifest, without importing them. Each line
+        holds the kind, the keyword and the class path:
+
+            directive   EDIT        fsdir.directives.edit:Edit
+
+        Blank lines and lines starting with # are skipped.
+        """
+        with open(manifest_path) as manifest:
+            for number, line in enumerate(manifest, 1):
+                line = line.strip()
+
+                if not line or line.startswith("#"):
+                    continue
+
+                parts = line.split()
+
+                if len(parts) != 3 or ":" not in parts[2]:
+                    raise ValueError("[%d] Not a valid manifest line in %s: %s"
+                                     % (number, manifest_path, line))
+
+                self.register(*parts)
+
+    def load_entry_points(self):
+        """
+        Registers the plugins installed packages declare as entry points, in
+        the fsdir.directives and fsdir.procedures groups. Nothing is done if
+        setuptools is not installed.
+        """
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+
+        for kind, group in ENTRY_POINT_GROUPS.iteritems():
+            for entry_point in pkg_resources.iter_entry_points(group):
+                self.register(kind, entry_point.name, "%s:%s" % (
+                    entry_point.module_name, ".".join(entry_point.attrs)))
@@ -0,0 +1,119 @@
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+
+
+class Scheduler(object):
+    """
+    Runs steps concurrently on a thread pool. A step only starts once every
+    previous step sharing one of its paths is done, steps over disjoint files
+    run in any order.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+        self._condition = threading.Condition()
+        self._waiting = None
+        self._dependents = None
+        self._running = 0
+        self._remaining = 0
+        self._error = None
+
+    @staticmethod
+    def dependencies(paths):
+        """
+        Builds the dependency graph: each step depends on the last previous
+        step that touched each one of its paths.
+
+        :param paths:   for each step, the set of paths it reads or writes.
+        :return:        for each step, the set of indexes it depends on.
+        """
+        last_step = {}
+        graph = []
+
+        for index, step_paths in enumerate(paths):
+            depends = set()
+
+            for path in step_paths:
+                if path in last_step:
+                    depends.add(last_step[path])
+
+                last_step[path] = index
+
+            graph.append(depends)
+
+        return graph
+
+    def run(self, steps, paths, run_step):
+        """
+        :param steps:       the steps, in script order.
+        :param paths:       for each step, the set of paths it touches.
+        :param run_step:    callable that executes a single step.
+        """
+        if self.jobs <= 1:
+            for step in steps:
+                run_step(step)
+
+            return
+
+        graph = self.dependencies(paths)
+
+        self._waiting = [len(depends) for depends in graph]
+        self._dependents = [[] for _ in steps]
+        self._running = 0
+        self._remaining = len(steps)
+        self._error = None
+
+        for index, depends in enumerate(graph):
+            for depend in depends:
+                self._dependents[depend].append(index)
+
+        pool = ThreadPool(self.jobs)
+
+        try:
+            with self._condition:
+                for index, waiting in enumerate(self._waiting):
+                    if not waiting:
+                        self._submit(pool, steps, run_step, index)
+
+                while self._remaining and not self._error:
+                    self._condition.wait()
+
+                # let the running steps finish before reporting.
+                while self._running:
+                    self._condition.wait()
+        finally:
+            pool.close()
+            pool.join()
+
+        if self._error:
+            raise self._error[0], self._error[1], self._error[2]
+
+    def _submit(self, pool, steps, run_step, index):
+        self._running += 1
+        pool.apply_async(self._execute, (pool, steps, run_step, index))
+
+    def _execute(self, pool, steps, run_step, index):
+        error = None
+
+        try:
+            run_step(steps[index])
+        except Exception:
+            error = sys.exc_info()
+
+        with self._condition:
+            self._running -= 1
+            self._remaining -= 1
+
+            if error and not self._error:
+                self._error = error
+
+            if not self._error:
+                for dependent in self._dependents[index]:
+                    self._waiting[dependent] -= 1
+
+                    if not self._waiting[dependent]:
+                        self._submit(pool, steps, run_step, dependent)
+
+            self._condition.notify_all()
@@ -0,0 +1,225 @@
+import argparse
+import collections
+import json
+import os
+import signal
+import socket
+import SocketServer
+import stat
+import sys
+import traceback
+from StringIO import StringIO
+
+from fsdir.util import argscontrol
+
+
+def default_socket_path():
+    return os.environ.get("FSDIR_SOCKET",
+                          "/tmp/fsdir-%d.sock" % os.getuid())
+
+
+class ScriptCache(object):
+    """
+    Parsed scripts by hash, the least recently used ones are dropped once
+    there are more than max_scripts.
+    """
+
+    def __init__(self, max_scripts=128):
+        self.max_scripts = max_scripts
+        self.scripts = collections.OrderedDict()
+
+    def get(self, digest):
+        commands = self.scripts.pop(digest, None)
+
+        if commands is not None:
+            self.scripts[digest] = commands
+
+        return commands
+
+    def __setitem__(self, digest, commands):
+        self.scripts.pop(digest, None)
+        self.scripts[digest] = commands
+
+        while len(self.scripts) > self.max_scripts:
+            self.scripts.popitem(last=False)
+
+    def __len__(self):
+        return len(self.scripts)
+
+
+class DirectorFactory(object):
+    """
+    Makes a fresh director for each request, sharing with every other one
+    what is worth keeping warm: the plugins, the parsed scripts and the stat
+    cache of the real file system.
+
+    Each director gets its own copy of the registry, so plugins a client
+    loads with --plugins or --entry-points don't stay for later requests.
+    """
+
+    def __init__(self, template, max_scripts=128):
+        """
+        :param template:        director with the plugins loaded.
+        :param max_scripts:     parsed scripts kept in memory.
+        """
+        self.template = template
+        self.script_cache = ScriptCache(max_scripts)
+
+    def create(self):
+        director = self.template.__class__()
+
+        director.registry = self.template.registry.copy()
+        director.script_cache = self.script_cache
+
+        stat_cache = self.template.dummy_fs.stat_cache
+        stat_cache.revalidate()
+        director.dummy_fs.stat_cache = stat_cache
+
+        return director
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Reads a single JSON request line: the command line arguments of the
+    client and its working directory. Answers with a JSON line holding the
+    exit status and everything printed while running.
+    """
+
+    def handle(self):
+        line = self.rfile.readline()
+
+        if not line:
+            return
+
+        try:
+            request = json.loads(line)
+        except ValueError:
+            response = {"status": 2, "stdout": "",
+                        "stderr": "Not a valid request.\n"}
+        else:
+            response = self.server.execute(request["argv"], request["cwd"])
+
+        self.wfile.write(json.dumps(response) + "\n")
+
+
+class Server(SocketServer.UnixStreamServer):
+    """
+    Runs the scripts sent to a Unix domain socket, one at a time, since each
+    one runs in the working directory of its client.
+    """
+
+    def __init__(self, socket_path, factory):
+        self.socket_path = socket_path
+        self.factory = factory
+
+        if os.path.exists(socket_path) and \
+                stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            if self._is_listening(socket_path):
+                raise ValueError("A daemon is already listening on %s" %
+                                 socket_path)
+
+            # left by a daemon that didn't stop cleanly.
+            os.remove(socket_path)
+
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               RequestHandler)
+
+    @staticmethod
+    def _is_listening(socket_path):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            connection.connect(socket_path)
+        except socket.error:
+            return False
+        finally:
+            connection.close()
+
+        return True
+
+    def server_bind(self):
+        SocketServer.UnixStreamServer.server_bind(self)
+
+        # scripts run with the rights of the daemon, only its user may send
+        # them.
+        os.chmod(self.socket_path, 0600)
+
+    def execute(self, argv, cwd):
+        """
+        :return:    the response, with the exit status and the output.
+        """
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        status = 0
+
+        # requests run in the directory of their client, the daemon goes
+        # back to its own once done.
+        previous_cwd = os.getcwd()
+
+        try:
+            os.chdir(cwd)
+            args = argscontrol._config_parser().parse_args(argv)
+
+            if args.watch:
+                raise ValueError("Watch mode is not available through the "
+                                 "daemon.")
+
+            argscontrol.execute(self.factory.create(), args)
+        except SystemExit as e:
+            # argparse exits on bad arguments, or after printing the help.
+            status = e.code if isinstance(e.code, int) else 1
+        except (ValueError, AssertionError) as e:
+            sys.stderr.write("%s: %s\n" % (e.__class__.__name__, e))
+            status = 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os.chdir(previous_cwd)
+            output, errors = sys.stdout.getvalue(), sys.stderr.getvalue()
+            sys.stdout, sys.stderr = stdout, stderr
+
+        return {"status": status, "stdout": output, "stderr": errors}
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def serve(director, argv):
+    """
+    Runs the daemon until interrupted.
+
+    :param director:    director with the plugins loaded.
+    :param argv:        the arguments after "serve".
+    """
+    parser = argparse.ArgumentParser(description="FileSystem Director daemon")
+    parser.add_argument(
+        '--socket',
+        help='Path of the socket to listen on',
+        default=default_socket_path()
+    )
+    parser.add_argument(
+        '--max-scripts',
+        help='Parsed scripts kept in memory',
+        type=int,
+        default=128
+    )
+
+    args = parser.parse_args(argv)
+    server = Server(args.socket, DirectorFactory(director, args.max_scripts))
+
+    # stop cleanly when terminated, removing the socket.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print "Listening on %s" % args.socket
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
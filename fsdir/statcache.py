@@ -0,0 +1,210 @@
+import os
+import threading
+
+from fsdir.util.dirindex import read_directory
+
+
+class StatCache(object):
+    """
+    What the real file system holds, asked once and remembered. Each
+    directory is listed whole the first time one of its paths is looked up,
+    so checking many files of the same directory costs a single read.
+
+    Listings are kept between runs while the modification time of their
+    directory does not change, the stats of single files only last a run.
+    The files written through the sandbox are added and removed as they
+    change, so its directories are never listed twice in a run.
+    """
+
+    def __init__(self):
+        # absolute directory -> (modification time, directories, files).
+        self.directories = {}
+
+        # absolute path -> stat result, None when it does not exist.
+        self.stats = {}
+
+        self.hits = 0
+        self.misses = 0
+
+        # steps running in parallel write the same directories, and count
+        # their lookups.
+        self._lock = threading.Lock()
+
+    def listing(self, directory):
+        """
+        :param directory:   absolute path of the directory.
+        :return:            (modification time, directories, files), the
+                            time is None if the directory can't be read.
+        """
+        listing = self.directories.get(directory)
+
+        if listing is not None:
+            self._count(True)
+            return listing
+
+        with self._lock:
+            return self._listing(directory)
+
+    def _listing(self, directory):
+        listing = self.directories.get(directory)
+
+        if listing is not None:
+            self.hits += 1
+            return listing
+
+        self.misses += 1
+
+        try:
+            mtime = os.stat(directory).st_mtime
+            directories, files, _ = read_directory(directory)
+        except OSError:
+            listing = (None, frozenset(), frozenset())
+        else:
+            listing = (mtime, set(directories), set(files))
+
+        self.directories[directory] = listing
+
+        return listing
+
+    def isfile(self, abs_path):
+        directory, name = os.path.split(abs_path)
+
+        return name in self.listing(directory)[2]
+
+    def isdir(self, abs_path):
+        directory, name = os.path.split(abs_path)
+
+        if not name:
+            # the root.
+            return True
+
+        return name in self.listing(directory)[1]
+
+    def stat(self, abs_path):
+        """
+        :return:    the stat result of the path, None if it does not exist.
+        """
+        try:
+            info = self.stats[abs_path]
+        except KeyError:
+            self._count(False)
+        else:
+            self._count(True)
+            return info
+
+        try:
+            info = os.stat(abs_path)
+        except OSError:
+            info = None
+
+        self.stats[abs_path] = info
+
+        return info
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def update(self, abs_path):
+        """
+        Looks at a path again, after it was created, changed or removed.
+        """
+        with self._lock:
+            self._update(abs_path)
+
+    def _update(self, abs_path):
+        self.stats.pop(abs_path, None)
+
+        directory, name = os.path.split(abs_path)
+        listing = self.directories.get(directory)
+
+        if listing is None or listing[0] is None:
+            # nothing known about the directory yet, or it was missing.
+            self.directories.pop(directory, None)
+            return
+
+        _, directories, files = listing
+
+        directories.discard(name)
+        files.discard(name)
+
+        if os.path.isdir(abs_path):
+            directories.add(name)
+        elif os.path.isfile(abs_path):
+            files.add(name)
+
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            self.directories.pop(directory, None)
+        else:
+            self.directories[directory] = (mtime, directories, files)
+
+    def add_file(self, path):
+        """
+        Records a file just written, without looking at it again. Its
+        directory is listed first if it was not yet.
+        """
+        with self._lock:
+            self.stats.pop(path, None)
+
+            directory, name = os.path.split(path)
+            mtime, directories, files = self._listing(directory)
+
+            if mtime is None:
+                # the directory was created since, by the one writing.
+                mtime = os.stat(directory).st_mtime
+                directories = set()
+                files = set()
+                self.directories[directory] = (mtime, directories, files)
+
+            files.add(name)
+
+    def remove_file(self, path):
+        """
+        Records a file just removed.
+        """
+        with self._lock:
+            self.stats.pop(path, None)
+
+            directory, name = os.path.split(path)
+            listing = self.directories.get(directory)
+
+            if listing is not None and listing[0] is not None:
+                listing[2].discard(name)
+
+    def forget(self, root):
+        """
+        Drops everything known under a directory, changed by someone else.
+        """
+        root = root.rstrip(os.sep)
+        under = root + os.sep
+
+        with self._lock:
+            for cached in (self.directories, self.stats):
+                for path in cached.keys():
+                    if path == root or path.startswith(under):
+                        del cached[path]
+
+    def revalidate(self):
+        """
+        Starts a new run: drops the stats of single files, and the listings
+        of the directories modified since they were read.
+        """
+        self.stats = {}
+
+        for directory, listing in self.directories.items():
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                mtime = None
+
+            if mtime is None or mtime != listing[0]:
+                del self.directories[directory]
+
+    def clear(self):
+        self.directories = {}
+        self.stats = {}
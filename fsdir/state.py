@@ -0,0 +1,144 @@
+import marshal
+import os
+
+from fsdir.util.atomicfile import AtomicFile
+
+
+class VirtualState(object):
+    """
+    Index of every path the dummy file system knows about, without touching
+    the disk: a hash map from absolute path to its status, and a trie of the
+    directories containing those paths.
+    """
+
+    CREATED = 1
+    MODIFIED = 2
+    REMOVED = 3
+
+    def __init__(self):
+        self.files = {}
+        self.tree = {}
+
+        # directory -> names of the files in it the state knows about.
+        self.directories = {}
+
+        self._abspaths = {}
+
+    def abspath(self, file_path):
+        """
+        Cached version of os.path.abspath, the working directory is not
+        expected to change during a run.
+
+        :param file_path:   the path to be converted.
+        :return:            the absolute path.
+        """
+        try:
+            return self._abspaths[file_path]
+        except KeyError:
+            abs_path = os.path.abspath(file_path)
+            self._abspaths[file_path] = abs_path
+            return abs_path
+
+    def status(self, abs_path):
+        return self.files.get(abs_path)
+
+    def create(self, abs_path):
+        self._set(abs_path, self.CREATED)
+
+    def modify(self, abs_path):
+        if self.files.get(abs_path) != self.CREATED:
+            self._set(abs_path, self.MODIFIED)
+
+    def remove(self, abs_path):
+        self._set(abs_path, self.REMOVED)
+
+    def _set(self, abs_path, status):
+        self.files[abs_path] = status
+
+        directory, name = os.path.split(abs_path)
+        self.directories.setdefault(directory, set()).add(name)
+
+        if status != self.REMOVED:
+            self._add_dirs(abs_path)
+
+    def paths(self, status=None):
+        """
+        :param status:  only paths with this status, every path if None.
+        :return:        the list of paths.
+        """
+        if status is None:
+            return list(self.files)
+
+        return [path for path, value in self.files.iteritems()
+                if value == status]
+
+    def save(self, path):
+        """
+        Writes the status of every path, so the changes can be applied by
+        another process.
+        """
+        with AtomicFile(path) as target:
+            marshal.dump(self.files, target.file)
+
+    def load(self, path):
+        """
+        Adds the statuses written by save().
+        """
+        with open(path, "rb") as source:
+            files = marshal.load(source)
+
+        for abs_path, status in files.iteritems():
+            self._set(abs_path, status)
+
+    def isdir(self, abs_path):
+        return self._find_node(abs_path) is not None
+
+    def children(self, abs_path):
+        """
+        :param abs_path:    a directory.
+        :return:            the names of the known directories inside it.
+        """
+        node = self._find_node(abs_path)
+        return sorted(node) if node else []
+
+    def listing(self, abs_path):
+        """
+        :param abs_path:    a directory.
+        :return:            (names of the files the state adds to it, names
+                            of the files removed from it).
+        """
+        present = set()
+        removed = set()
+
+        for name in self.directories.get(abs_path, ()):
+            if self.files[os.path.join(abs_path, name)] == self.REMOVED:
+                removed.add(name)
+            else:
+                present.add(name)
+
+        return present, removed
+
+    def clear(self):
+        self.files = {}
+        self.tree = {}
+        self.directories = {}
+
+    def _split(self, abs_path):
+        return [part for part in abs_path.split(os.sep) if part]
+
+    def _add_dirs(self, abs_path):
+        node = self.tree
+
+        for part in self._split(os.path.dirname(abs_path)):
+            node = node.setdefault(part, {})
+
+    def _find_node(self, abs_path):
+        node = self.tree
+
+        for part in self._split(abs_path):
+            node = node.get(part)
+
+            if node is None:
+                return None
+
+        return node
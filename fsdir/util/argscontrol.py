@@ -1,16 +1,119 @@
 import argparse
+import cProfile
 
 import sys
 
+from fsdir.fanout import FanOut
+from fsdir.parser.regextokenizer import RegexTokenizer
+from fsdir.parser.tokenizer import Tokenizer
+from fsdir.profiler import Profiler
+from fsdir.watcher import Watcher
 
-def config_argv(director):
-    args = _config_parser().parse_args()
+# tokenizers by the name --tokenizer takes, both give the same tokens.
+TOKENIZERS = {
+    "regex": RegexTokenizer,
+    "legacy": Tokenizer,
+}
 
+
+def config_argv(director, argv=None):
+    """
+    Runs the director as told by the command line arguments, "serve" as first
+    argument starts the daemon instead.
+
+    :param argv:    the arguments, the ones of the process by default.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv and argv[0] == "serve":
+        from fsdir.server import serve
+        serve(director, argv[1:])
+        return
+
+    execute(director, _config_parser().parse_args(argv))
+
+
+def execute(director, args):
     director.display = args.display
+    director.dummy_fs.copy_on_write = not args.copy
+    director.memory_sandbox = args.memory
+    director.memory_cap = args.memory_cap
+    director.streaming = args.stream
+    director.jobs = args.jobs
+    director.processes = args.processes or 1
+    director.io_threads = args.io_threads
+    director.prefetch_bytes = args.prefetch_bytes
+    director.cache_dir = args.incremental
+    director.compile_scripts = args.compiled is not None
+    director.compiled_dir = args.compiled
+    director.lazy_parse = args.lazy
+    director.tokenizer_class = TOKENIZERS[args.tokenizer]
+
+    for manifest_path in args.plugins or []:
+        director.load_plugins(manifest_path)
+
+    if args.entry_points:
+        director.registry.load_entry_points()
 
     if args.sandbox:
         director.sandbox_dir = args.sandbox
 
+    if args.watch:
+        Watcher(director, args.file, args.interval).watch()
+        return
+
+    roots = _roots(args)
+
+    if roots:
+        if args.profile is not None:
+            raise ValueError("--profile is not available with --roots.")
+
+        fan_out = FanOut(director, args.processes)
+        results = fan_out.run(director.parse(args.file), roots, args.test,
+                              args.apply, args.keep)
+
+        if fan_out.summary(results):
+            sys.exit(1)
+
+        return
+
+    profiler = None
+    profile = None
+
+    if args.profile is not None:
+        profiler = Profiler()
+        profiler.install(director)
+
+        if args.profile and not args.profile.endswith(".json"):
+            profile = cProfile.Profile()
+            profile.enable()
+
+    try:
+        _run(director, args)
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.profile)
+
+        if profiler:
+            profiler.report()
+
+            if args.profile.endswith(".json"):
+                profiler.dump_json(args.profile)
+
+
+def _roots(args):
+    roots = list(args.roots or [])
+
+    if args.roots_file:
+        with open(args.roots_file) as roots_file:
+            roots.extend(line.strip() for line in roots_file if line.strip())
+
+    return roots
+
+
+def _run(director, args):
     director.load(args.file)
 
     if not args.test and not args.run and not args.apply:
@@ -34,7 +137,11 @@ def config_argv(director):
 
 
 def _config_parser():
-    parser = argparse.ArgumentParser(description="FileSystem Director")
+    parser = argparse.ArgumentParser(
+        description="FileSystem Director",
+        epilog='"%(prog)s serve [--socket PATH]" starts a daemon running the '
+               'scripts sent by client.py'
+    )
 
     parser.add_argument(
         'file',
@@ -89,4 +196,140 @@ def _config_parser():
         action='store_true'
     )
 
+    parser.add_argument(
+        '-c',
+        '--copy',
+        help='Copy every touched file into the sandbox, even if unchanged',
+        action='store_true'
+    )
+
+    parser.add_argument(
+        '-m',
+        '--memory',
+        help='Keep the sandbox in memory',
+        action='store_true'
+    )
+
+    parser.add_argument(
+        '--memory-cap',
+        help='Bytes kept in memory by the sandbox before spilling to disk',
+        type=int
+    )
+
+    parser.add_argument(
+        '--stream',
+        help='Stream edited files line by line instead of loading them',
+        action='store_true'
+    )
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        help='Run up to this many commands at once, if they share no file',
+        type=int,
+        default=1
+    )
+
+    parser.add_argument(
+        '-p',
+        '--processes',
+        help='Processes used to replace over many files, or to run over '
+             'many roots (all the CPUs by default)',
+        type=int
+    )
+
+    parser.add_argument(
+        '--io-threads',
+        help='Read the files of upcoming commands ahead on this many threads, '
+             'for high latency file systems',
+        type=int,
+        default=0
+    )
+
+    parser.add_argument(
+        '--prefetch-bytes',
+        help='Bytes of files read ahead kept in memory',
+        type=int,
+        default=64 * 1024 * 1024
+    )
+
+    parser.add_argument(
+        '-i',
+        '--incremental',
+        help='Reuse the results of unchanged commands, kept in this directory',
+        nargs='?',
+        const='.fsdir-cache'
+    )
+
+    parser.add_argument(
+        '-C',
+        '--compiled',
+        help='Keep the script compiled, next to it or in the given directory',
+        nargs='?',
+        const=''
+    )
+
+    parser.add_argument(
+        '-l',
+        '--lazy',
+        help='Parse and validate the script while reading it',
+        action='store_true'
+    )
+
+    parser.add_argument(
+        '--tokenizer',
+        help='Tokenizer of the scripts: the regular expression one, or the '
+             'legacy one that reads a character at a time',
+        choices=sorted(TOKENIZERS),
+        default='regex'
+    )
+
+    parser.add_argument(
+        '-w',
+        '--watch',
+        help='Run the script again, into the sandbox, whenever it or one of '
+             'its files changes',
+        action='store_true'
+    )
+
+    parser.add_argument(
+        '--interval',
+        help='Seconds between checks for changes in watch mode',
+        type=float,
+        default=0.5
+    )
+
+    parser.add_argument(
+        '--profile',
+        help='Print the time, bytes and files of each command. Raw data is '
+             'dumped to the given file, as JSON if it ends with .json, as '
+             'cProfile stats otherwise',
+        nargs='?',
+        const=''
+    )
+
+    parser.add_argument(
+        '--roots',
+        help='Run the script against each root directory, absolute paths '
+             'are taken inside each root',
+        nargs='+'
+    )
+
+    parser.add_argument(
+        '--roots-file',
+        help='File with a root directory per line, as --roots'
+    )
+
+    parser.add_argument(
+        '--plugins',
+        help='Register the plugins listed in a manifest, may be repeated',
+        action='append'
+    )
+
+    parser.add_argument(
+        '--entry-points',
+        help='Register the plugins declared by installed packages',
+        action='store_true'
+    )
+
     return parser
\ No newline at end of file
@@ -0,0 +1,90 @@
+import binascii
+import errno
+import os
+import shutil
+
+
+def create_temp(directory, prefix):
+    """
+    Creates a new file with a unique name, like tempfile.mkstemp does, but
+    with the mode any new file gets (0666 less the umask) instead of 0600.
+
+    :return:    (file descriptor, path).
+    """
+    while True:
+        temp_path = os.path.join(
+            directory, prefix + binascii.hexlify(os.urandom(6)))
+
+        try:
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         0666)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        else:
+            return fd, temp_path
+
+
+class AtomicFile(object):
+    """
+    Writable file that replaces the target path only when closed, so readers
+    never see a half-written file. The content goes to a temporary file in the
+    same directory, which is renamed over the target.
+    """
+
+    def __init__(self, target_path, mode_path=None):
+        """
+        :param target_path:     the file to be replaced.
+        :param mode_path:       file to copy the permission bits from.
+        """
+        self.target_path = target_path
+        self.mode_path = mode_path
+
+        fd, self.temp_path = create_temp(
+            os.path.dirname(target_path) or os.curdir,
+            ".%s." % os.path.basename(target_path)
+        )
+        self.file = os.fdopen(fd, "wb")
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def write(self, data):
+        self.file.write(data)
+
+    def writelines(self, lines):
+        self.file.writelines(lines)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self.file.close()
+
+        # new files keep the mode they were created with.
+        if self.mode_path:
+            shutil.copymode(self.mode_path, self.temp_path)
+
+        os.rename(self.temp_path, self.target_path)
+
+    def discard(self):
+        """
+        Drops everything written, the target is left untouched.
+        """
+        self.file.close()
+
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.discard()
+        else:
+            self.close()
@@ -0,0 +1,196 @@
+import fnmatch
+import os
+import re
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+MAGIC = re.compile(r"[*?[]")
+
+
+def has_magic(pattern):
+    return MAGIC.search(pattern) is not None
+
+
+def read_directory(directory):
+    """
+    :return:    (directories, files, links) in the directory, sorted by name,
+                links are the directories that are symbolic links. Entries
+                that are neither, like broken links, are left out.
+    """
+    directories = []
+    files = []
+    links = set()
+
+    if scandir:
+        for entry in scandir(directory):
+            if entry.is_dir():
+                directories.append(entry.name)
+
+                if entry.is_symlink():
+                    links.add(entry.name)
+            elif entry.is_file():
+                files.append(entry.name)
+    else:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+
+            if os.path.isdir(path):
+                directories.append(name)
+
+                if os.path.islink(path):
+                    links.add(name)
+            elif os.path.isfile(path):
+                files.append(name)
+
+    directories.sort()
+    files.sort()
+
+    return directories, files, links
+
+
+class DirectoryIndex(object):
+    """
+    Listings of the directories visited while expanding path patterns. Each
+    directory is read once, however many patterns go through it, so every
+    command of a script shares the same reads.
+
+    Patterns follow glob: "*", "?" and "[...]" match within a single name,
+    and a "**" component matches any amount of nested directories. Names
+    starting with a dot are only matched by patterns starting with a dot.
+
+    Given a virtual state, the files it creates or removes are laid over the
+    listings, so patterns match what the script sees at that point.
+    """
+
+    RECURSIVE = "**"
+
+    def __init__(self, state=None):
+        # directory -> (directories, files, symbolic links to directories),
+        # names are sorted.
+        self.listings = {}
+        self.state = state
+
+    def listing(self, directory):
+        """
+        :param directory:   the directory, "" for the current one.
+        :return:            (directories, files, links) in the directory,
+                            empty if it cannot be read.
+        """
+        listing = self.listings.get(directory)
+
+        if listing is None:
+            try:
+                listing = read_directory(directory or os.curdir)
+            except OSError:
+                listing = ([], [], set())
+
+            self.listings[directory] = listing
+
+        if self.state:
+            return self._overlay(directory, listing)
+
+        return listing
+
+    def _overlay(self, directory, listing):
+        abs_path = self.state.abspath(directory or os.curdir)
+        present, removed = self.state.listing(abs_path)
+        children = self.state.children(abs_path)
+
+        if not present and not removed and not children:
+            return listing
+
+        directories, files, links = listing
+
+        files = sorted((set(files) | present) - removed)
+        directories = sorted(set(directories).union(children))
+
+        return directories, files, links
+
+    def expand(self, pattern):
+        """
+        :param pattern:     a path, or a pattern of paths.
+        :return:            the files matching the pattern, or the pattern
+                            itself when it's a plain path or nothing matches.
+        """
+        if not has_magic(pattern):
+            return [pattern]
+
+        parts = [part for part in pattern.split(os.sep) if part]
+        base = os.sep if os.path.isabs(pattern) else ""
+
+        results = []
+        self._expand(base, parts, results)
+
+        if not results:
+            return [pattern]
+
+        seen = set()
+
+        return [path for path in results
+                if not (path in seen or seen.add(path))]
+
+    def _expand(self, base, parts, results):
+        part = parts[0]
+        rest = parts[1:]
+
+        if part == self.RECURSIVE:
+            for directory in self._walk(base):
+                if rest:
+                    self._expand(directory, rest, results)
+                else:
+                    self._add_files(directory, "*", results)
+
+            return
+
+        if not rest:
+            self._add_files(base, part, results)
+            return
+
+        if has_magic(part):
+            names = self._filter(self.listing(base)[0], part)
+        else:
+            # plain names, such as "..", are followed without listing.
+            names = [part]
+
+        for name in names:
+            self._expand(os.path.join(base, name), rest, results)
+
+    def _add_files(self, directory, part, results):
+        files = self.listing(directory)[1]
+
+        if has_magic(part):
+            names = self._filter(files, part)
+        elif part in files:
+            names = [part]
+        else:
+            names = []
+
+        for name in names:
+            results.append(os.path.join(directory, name))
+
+    def _walk(self, directory):
+        """
+        Yields the directory and every directory below it, without following
+        symbolic links, nor entering hidden directories.
+        """
+        yield directory
+
+        directories, _, links = self.listing(directory)
+
+        for name in directories:
+            if name not in links and not name.startswith("."):
+                for sub_directory in self._walk(
+                        os.path.join(directory, name)):
+                    yield sub_directory
+
+    @staticmethod
+    def _filter(names, part):
+        names = fnmatch.filter(names, part)
+
+        if not part.startswith("."):
+            names = [name for name in names if not name.startswith(".")]
+
+        return names
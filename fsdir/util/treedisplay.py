@@ -44,3 +44,36 @@ def display(directory):
     tree = _make_tree(root)
 
     tree.display()
+
+
+def display_paths(directory, paths):
+    """
+    Display a tree made of the given file paths, without looking at the disk.
+
+    :param directory:   the name of the root.
+    :param paths:       file paths, all of them inside the root.
+    """
+    root = Node(directory)
+    root.isdir = True
+
+    for file_path in paths:
+        tree = root
+        parts = os.path.relpath(file_path, directory).split(os.sep)
+
+        for depth in range(1, len(parts) + 1):
+            name = os.path.join(directory, *parts[:depth])
+            sub_node = None
+
+            for node in tree.nodes:
+                if node.name == name:
+                    sub_node = node
+                    break
+
+            if not sub_node:
+                sub_node = Node(name)
+                sub_node.isdir = depth < len(parts)
+                tree.add_node(sub_node)
+
+            tree = sub_node
+
+    root.display()
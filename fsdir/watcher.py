@@ -0,0 +1,213 @@
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class Watcher(object):
+    """
+    Keeps a director resident, running its script into the sandbox again each
+    time the script or one of the files named by its directives changes.
+
+    Every run goes through the result cache, so only the steps whose commands
+    or input files changed are executed, the rest get their results restored.
+    The sandbox directory is updated in place: restored files it already
+    holds are kept as they are, and only the changed ones are written.
+    Changes are detected with inotify when pyinotify is installed, otherwise
+    by polling the modification time of each watched file.
+    """
+
+    # inotify events that may change a watched file.
+    EVENTS = ('IN_CLOSE_WRITE', 'IN_MOVED_TO', 'IN_MOVED_FROM', 'IN_CREATE',
+              'IN_DELETE', 'IN_ATTRIB')
+
+    def __init__(self, director, file_path, interval=0.5):
+        """
+        :param director:    the director, with its plugins loaded.
+        :param file_path:   the path of the .fsdir script.
+        :param interval:    seconds between two looks at the watched files.
+        """
+        self.director = director
+        self.file_path = file_path
+        self.interval = interval
+
+        self.paths = set()
+        self.runs = 0
+
+        # the watched files as they were when the last run started.
+        self.before = {}
+
+    def watched_paths(self):
+        """
+        :return:    the script, every file named by a directive and every
+                    directory listed to expand patterns, so new files matching
+                    a pattern are noticed too.
+        """
+        paths = set([os.path.abspath(self.file_path)])
+
+        for directory in self.director.dir_index.listings:
+            paths.add(os.path.abspath(directory or os.curdir))
+
+        for _, _, extract in self.director.cache:
+            for file_path in extract.tokens:
+                paths.add(os.path.abspath(file_path))
+
+        return paths
+
+    @staticmethod
+    def snapshot(paths):
+        """
+        :return:    dict of path to (mtime, size, mode), None for missing files.
+        """
+        stats = {}
+
+        for path in paths:
+            try:
+                info = os.stat(path)
+            except OSError:
+                stats[path] = None
+            else:
+                stats[path] = (info.st_mtime, info.st_size, info.st_mode)
+
+        return stats
+
+    def watch_from(self, before):
+        """
+        Watches the files of the script loaded, compared to their state
+        before the run, or to their current one if they were not watched yet.
+
+        :param before:  snapshot taken before loading the script.
+        """
+        self.paths = self.watched_paths()
+        self.before = self.snapshot(self.paths.difference(before))
+
+        for path in self.paths.intersection(before):
+            self.before[path] = before[path]
+
+    def run_once(self):
+        """
+        Loads the script again and runs it into the sandbox. Invalid scripts
+        and failed runs are reported, the watcher keeps going.
+
+        :return:    True if the script ran.
+        """
+        director = self.director
+
+        # taken before reading anything, so changes made during the run
+        # trigger another one.
+        before = self.snapshot(self.paths |
+                               set([os.path.abspath(self.file_path)]))
+
+        director.reset()
+
+        director.dummy_fs.stat_cache.hits = 0
+        director.dummy_fs.stat_cache.misses = 0
+
+        try:
+            director.load(self.file_path)
+            director.validate()
+        except Exception as e:
+            self.watch_from(before)
+            print "[watch] %s: %s" % (e.__class__.__name__, e)
+            return False
+
+        self.watch_from(before)
+
+        result_cache = director.result_cache
+
+        if result_cache:
+            result_cache.hits = 0
+            result_cache.misses = 0
+            result_cache.kept = 0
+
+        started = time.time()
+
+        try:
+            director.sandbox_run()
+        except Exception as e:
+            print "[watch] run failed, %s: %s" % (e.__class__.__name__, e)
+            return False
+
+        self.runs += 1
+
+        result_cache = director.result_cache
+        stat_cache = director.dummy_fs.stat_cache
+        print "[watch] run %d: %d steps run, %d restored (%d files kept) in " \
+              "%.3fs (stat cache: %d hits, %d misses)" % (
+                  self.runs, result_cache.misses, result_cache.hits,
+                  result_cache.kept, time.time() - started, stat_cache.hits,
+                  stat_cache.misses)
+
+        return True
+
+    def watch(self):
+        """
+        Runs the script, and again after every change, until interrupted.
+        """
+        temp_dir = None
+        self.director.reuse_sandbox = True
+
+        if not self.director.cache_dir:
+            temp_dir = tempfile.mkdtemp(prefix="fsdir-watch-")
+            self.director.cache_dir = temp_dir
+
+        try:
+            self.run_once()
+
+            while True:
+                self.wait()
+                self.run_once()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if temp_dir:
+                self.director.cache_dir = None
+                self.director.result_cache = None
+                shutil.rmtree(temp_dir)
+
+    def wait(self):
+        """
+        Blocks until one of the watched files changed since the last run
+        started.
+        """
+        if pyinotify:
+            self._wait_inotify(self.before)
+        else:
+            self._wait_poll(self.before)
+
+    def _wait_poll(self, before):
+        while self.snapshot(self.paths) == before:
+            time.sleep(self.interval)
+
+    def _wait_inotify(self, before):
+        """
+        Watches the directories of the watched files, any event just wakes up
+        the watcher, which then compares the files as polling does.
+        """
+        mask = 0
+
+        for event in self.EVENTS:
+            mask |= getattr(pyinotify, event)
+
+        manager = pyinotify.WatchManager()
+        directories = set(os.path.dirname(path) for path in self.paths)
+
+        for directory in directories:
+            if os.path.isdir(directory):
+                manager.add_watch(directory, mask)
+
+        notifier = pyinotify.Notifier(manager, lambda event: None,
+                                      timeout=int(self.interval * 1000))
+
+        try:
+            while self.snapshot(self.paths) == before:
+                if notifier.check_events():
+                    notifier.read_events()
+                    notifier.process_events()
+        finally:
+            notifier.stop()
@@ -5,18 +5,9 @@ import sys
 
 director = fsdir.fsdirector.FSDirector()
 
-# load plugins.
-director.load_directive(fsdir.directives.Edit)
-director.load_directive(fsdir.directives.Create)
-director.load_directive(fsdir.directives.Read)
-director.load_directive(fsdir.directives.Remove)
-director.load_directive(fsdir.directives.File)
-
-director.load_procedure(fsdir.procedures.Append)
-director.load_procedure(fsdir.procedures.CopyTo)
-director.load_procedure(fsdir.procedures.Replace)
-director.load_procedure(fsdir.procedures.Set)
-director.load_procedure(fsdir.procedures.ChMod)
+# register plugins. The built-in ones are already imported with the fsdir
+# package, other ones are imported when a script first uses them.
+director.load_plugins()
 
 # EXAMPLE AS TERMINAL COMMAND:
 # load the fsdir script from argv.
@@ -24,6 +15,9 @@ director.load_procedure(fsdir.procedures.ChMod)
 director.load_argv()
 
 # == EXAMPLE AS API ==
+# load a single plugin.
+# director.load_directive(fsdir.directives.Edit)
+
 # load the script from file.
 # director.load("dev.fsdir")
 
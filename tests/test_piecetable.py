@@ -0,0 +1,72 @@
+import random
+import unittest
+
+from fsdir.piecetable import PieceTable
+
+
+def naive_splice(content, edits):
+    """
+    The same edits applied to a plain string, from the last one so the
+    offsets of the others stay valid.
+    """
+    for start, end, text in reversed(edits):
+        content = content[:start] + text + content[end:]
+
+    return content
+
+
+class PieceTableTest(unittest.TestCase):
+    CASES = 5000
+
+    def random_text(self, generator, maximum):
+        return "".join(generator.choice("ab\n")
+                       for _ in range(generator.randint(0, maximum)))
+
+    def random_edits(self, generator, length):
+        """
+        :return:    sorted edits not overlapping, some of them insertions.
+        """
+        offsets = sorted(generator.randint(0, length)
+                         for _ in range(2 * generator.randint(0, 4)))
+        edits = []
+
+        for start, end in zip(offsets[::2], offsets[1::2]):
+            if generator.random() < 0.3:
+                end = start
+
+            edits.append((start, end, self.random_text(generator, 5)))
+
+        return edits
+
+    def test_splice_matches_string(self):
+        generator = random.Random(0)
+
+        for _ in range(self.CASES):
+            content = self.random_text(generator, 40)
+            table = PieceTable(content)
+
+            # a few rounds, so the table holds several pieces.
+            for _ in range(generator.randint(1, 4)):
+                if generator.random() < 0.3:
+                    text = self.random_text(generator, 5)
+                    table.append(text)
+                    content += text
+
+                edits = self.random_edits(generator, len(content))
+                table.splice(edits)
+                content = naive_splice(content, edits)
+
+                self.assertEqual(table.content(), content, edits)
+                self.assertEqual(len(table), len(content))
+
+            table.CHUNK_SIZE = generator.randint(1, 8)
+            self.assertEqual(list(table), content.splitlines(True))
+
+    def test_splice_out_of_content(self):
+        table = PieceTable("abc")
+
+        self.assertRaises(ValueError, table.splice, [(5, 6, "x")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import random
+import unittest
+
+from fsdir.parser.regextokenizer import RegexTokenizer
+from fsdir.parser.tokenizer import Tokenizer
+
+# pieces of scripts, unterminated ones included.
+FRAGMENTS = [
+    "EDIT", "FILE", "REPLACE", "A", " ", "  ", "\t", "\n", "\n\n",
+    "'a/b.txt'", "''", "'a", "(777)", "()", "(a", "{\n  text\n}", "{}",
+    "{x}", "{\n", "# comment", "#",
+]
+
+# pieces no token starts with, only a few scripts get one.
+INVALID = ["x", "\xc3\xa9", ")", "}"]
+
+
+def tokenize(tokenizer_class, source):
+    """
+    :return:    the tokens, or the class of the error raised.
+    """
+    try:
+        return tokenizer_class(source).tokens
+    except Exception as e:
+        return e.__class__
+
+
+class RegexTokenizerTest(unittest.TestCase):
+    CASES = 20000
+
+    def test_same_tokens_as_tokenizer(self):
+        generator = random.Random(0)
+
+        for _ in range(self.CASES):
+            source = "".join(
+                generator.choice(INVALID if generator.random() < 0.01
+                                 else FRAGMENTS)
+                for _ in range(generator.randint(0, 12)))
+
+            self.assertEqual(tokenize(RegexTokenizer, source),
+                             tokenize(Tokenizer, source), repr(source))
+
+    def test_example_script(self):
+        script_path = os.path.join(os.path.dirname(__file__), os.pardir,
+                                   "example", "dev.fsdir")
+
+        with open(script_path) as script:
+            source = script.read()
+
+        self.assertEqual(RegexTokenizer(source).tokens,
+                         Tokenizer(source).tokens)
+
+
+if __name__ == "__main__":
+    unittest.main()